@@ -0,0 +1,78 @@
+import sys
+
+import page_cache
+import scrape_538
+import scrape_economist_statewide_margins as economist
+
+from time import perf_counter
+
+'''
+Time the lxml parsing (`html_extract`) against the BeautifulSoup parsing on
+the 538 and Economist pages saved in the page cache, and check that both
+get the same results from every page.
+
+    python benchmark_parsers.py            # every saved page, 3 times each
+    python benchmark_parsers.py 10         # 10 times each
+
+'''
+
+PARSERS = ['bs4', 'lxml']
+
+
+def main(repeat=3):
+    '''
+    Parse every cached page `repeat` times with each parser and print how
+    long each one took in total.
+
+    '''
+
+    cache = page_cache.default_cache()
+
+    # pages evicted since they were indexed come back as None
+    pages = {}
+    for kind in ['538', 'economist']:
+        found = [cache.latest(kind, key) for key in cache.keys(kind)]
+        pages[kind] = [page.decode('utf-8') for page in found
+                       if page is not None]
+
+    parse = {
+        '538': scrape_538.parse_polls,
+        'economist': economist.parse_page
+        }
+
+    for kind in ['538', 'economist']:
+        if len(pages[kind]) == 0:
+            print('no %s pages saved' % kind)
+            continue
+
+        results, took = {}, {}
+        for parser in PARSERS:
+            start = perf_counter()
+            for i in range(repeat):
+                results[parser] = [parse[kind](page, parser)
+                                   for page in pages[kind]]
+            took[parser] = (perf_counter() - start) / repeat
+
+        same = all(same_result(a, b) for a, b in zip(results['bs4'],
+                                                      results['lxml']))
+
+        print('%s: %s pages, bs4 %.3fs, lxml %.3fs (%.1fx), same: %s' % (
+            kind, len(pages[kind]), took['bs4'], took['lxml'],
+            took['bs4'] / took['lxml'], same
+            ))
+
+
+def same_result(a, b):
+    '''
+    Check two parsers' results from the same page match.
+
+    '''
+
+    if hasattr(a, 'equals'):
+        return a.equals(b)
+
+    return a == b
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,132 @@
+import os
+import sys
+
+import mixed_model
+import simulate_markets
+
+import numpy as np
+import pandas as pd
+
+'''
+Check `mixed_model` against lme4 (through rpy2) on recorded training data:
+fit `price ~ percent + net_polling + (1|incumbency) + (1|contract)` both ways
+and print how far apart the fixed effects, random intercepts, residual sd,
+and REML criterion are.
+
+    python check_mixed_model.py                 # record today's data first
+    python check_mixed_model.py training.csv    # use a recorded file
+
+'''
+
+RECORD_NAME = 'mixed_model_training.csv'
+
+FORMULA = 'price ~ percent + net_polling + (1|incumbency) + (1|contract)'
+
+
+def main(path=None, seed=0):
+    '''
+    Compare the two fits on the training data in `path`, recording one
+    simulation's training data from today's polls and markets if there
+    isn't one.
+
+    '''
+
+    if path is None:
+        path = RECORD_NAME
+        record(path, seed)
+
+    data = pd.read_csv(path)
+
+    ours = fit_python(data)
+    theirs = fit_lme4(data)
+
+    print('fixed effects:', ours['fixed'], theirs['fixed'])
+    print('largest fixed effect difference: %.2e' %
+          np.abs(ours['fixed'] - theirs['fixed']).max())
+
+    for name in ['incumbency', 'contract']:
+        for level, value in theirs['random'][name].items():
+            print('%s %s: %.6f vs %.6f' % (name, level,
+                                           ours['random'][name][level],
+                                           value))
+
+    print('sigma: %.6f vs %.6f' % (ours['sigma'], theirs['sigma']))
+    print('REML criterion: %.4f vs %.4f' % (ours['deviance'],
+                                             theirs['deviance']))
+
+
+def record(path, seed=0):
+    '''
+    Save the training data from the first simulation of today's run.
+
+    '''
+
+    today = pd.Timestamp.today().normalize() - pd.Timedelta(days=1)
+    simulation = simulate_markets.Simulation(simulate_markets.load_markets(),
+                                             simulate_markets.load_polls(),
+                                             today)
+
+    percent, net, keep = simulation.top_two(simulation.draw([0], seed))
+
+    train = simulation.train
+    rows = train['poll_row'].values
+    train = train.assign(percent=percent[0, rows], net_polling=net[0, rows])
+    train = train[keep[0, rows]]
+
+    train[['price', 'percent', 'net_polling', 'incumbency',
+           'contract']].to_csv(path, index=False)
+
+
+def fit_python(data):
+    '''
+    Fit with `mixed_model`.
+
+    '''
+
+    model = mixed_model.RandomIntercepts({
+        'incumbency': data['incumbency'].astype(str).values,
+        'contract': data['contract'].values
+        })
+    X = np.column_stack([np.ones(len(data)), data['percent'],
+                         data['net_polling']])
+
+    return model.fit_batch(X[None], data['price'].values)[0]
+
+
+def fit_lme4(data):
+    '''
+    Fit with lme4's lmer, by REML.
+
+    '''
+
+    os.environ.setdefault('R_HOME',
+                          '/Library/Frameworks/R.framework/Resources')
+    import rpy2.robjects as robjects
+    from rpy2.robjects import pandas2ri
+    from rpy2.robjects.conversion import localconverter
+
+    data = data.assign(incumbency=data['incumbency'].astype(str))
+
+    with localconverter(robjects.default_converter + pandas2ri.converter):
+        robjects.globalenv['training'] = robjects.conversion.py2rpy(data)
+
+    r = robjects.r
+    r('library(lme4)')
+    r('model <- lmer(%s, data=training, REML=TRUE)' % FORMULA)
+
+    random = {}
+    for name in ['incumbency', 'contract']:
+        effects = r('ranef(model)$%s' % name)
+        levels = list(r('rownames(ranef(model)$%s)' % name))
+        random[name] = dict(zip(levels, np.array(effects[0])))
+
+    return {
+        'fixed': np.array(r('unname(fixef(model))')),
+        'random': random,
+        'sigma': r('sigma(model)')[0],
+        'deviance': r('REMLcrit(model)')[0]
+        }
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
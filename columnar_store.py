@@ -0,0 +1,142 @@
+import os
+import shutil
+
+import pandas as pd
+
+from uuid import uuid4
+
+'''
+Optional columnar (Parquet or Feather) copies of the datasets each step hands
+to the next: 538 polls, Predictit.com markets, and the Economist margins.
+
+Each dataset is split into folders by election and/or state, and dates are
+saved as real dates instead of strings. Reading one back can pick out just
+the columns it needs and skip every file outside a date range or state
+without opening it. The .csv files still get written either way.
+
+Set the PREDICTIT_STORAGE environment variable to 'parquet' or 'feather' to
+turn it on; `market_price_modeling.R` checks the same variable.
+
+'''
+
+FORMAT = os.environ.get('PREDICTIT_STORAGE', 'csv')  # csv, parquet, feather
+DATASET_DIR = 'datasets'
+
+# how each dataset is split up, its date column, and whether new writes
+# add to what's saved (one pull per day) instead of replacing it
+DATASETS = {
+    'polls': (['election', 'state'], 'poll_date', False),
+    'markets': (['election', 'state'], 'market_date', False),
+    'economist_margins': (['state'], 'date', True)
+    }
+
+# pyarrow's name for each format
+ARROW_FORMATS = {'parquet': 'parquet', 'feather': 'ipc'}
+
+
+def enabled():
+    '''
+    Return whether we're saving columnar copies at all.
+
+    '''
+
+    return FORMAT != 'csv'
+
+
+def write_dataset(df, name, fmt=None, root=DATASET_DIR):
+    '''
+    Save a DataFrame as a partitioned dataset. For datasets that keep every
+    pull, it gets added to what's saved. Otherwise it replaces everything
+    saved for the elections (or whatever the dataset is split by first) in
+    `df`, so states that drop out of a pull don't stick around, and leaves
+    the others alone (the polls get saved a chamber at a time).
+
+    '''
+
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    fmt = fmt or FORMAT
+    partition_cols, date_col, append = DATASETS[name]
+
+    # save dates as dates rather than strings
+    df = df.copy()
+    df[date_col] = pd.to_datetime(df[date_col]).dt.date
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    partitioning = ds.partitioning(
+        table.select(partition_cols).schema, flavor='hive'
+        )
+
+    if append:
+        # new file names so we don't write over earlier pulls
+        basename = 'part-' + uuid4().hex + '-{i}.' + fmt
+    else:
+        top = partition_cols[0]
+        for value in df[top].unique():
+            shutil.rmtree(os.path.join(root, name, '%s=%s' % (top, value)),
+                          ignore_errors=True)
+        basename = 'part-{i}.' + fmt
+
+    ds.write_dataset(table,
+                     os.path.join(root, name),
+                     format=ARROW_FORMATS[fmt],
+                     partitioning=partitioning,
+                     basename_template=basename,
+                     existing_data_behavior='overwrite_or_ignore')
+
+
+def read_dataset(name, columns=None, start=None, end=None, filters=None,
+                 fmt=None, root=DATASET_DIR):
+    '''
+    Load a saved dataset, reading only:
+        - the `columns` asked for (all of them by default)
+        - rows with a date between `start` and `end`, inclusive
+        - rows matching `filters`, a dict like {'state': 'maine'}
+
+    Filters on the election/state a dataset is split by skip whole files.
+
+    '''
+
+    import pyarrow.dataset as ds
+
+    fmt = fmt or FORMAT
+    partition_cols, date_col, append = DATASETS[name]
+
+    dataset = ds.dataset(os.path.join(root, name),
+                         format=ARROW_FORMATS[fmt],
+                         partitioning='hive')
+
+    condition = None
+    if start is not None:
+        condition = ds.field(date_col) >= pd.Timestamp(start).date()
+    if end is not None:
+        condition = combine(condition,
+                            ds.field(date_col) <= pd.Timestamp(end).date())
+    for col, value in (filters or {}).items():
+        condition = combine(condition, ds.field(col) == value)
+
+    table = dataset.to_table(columns=columns, filter=condition)
+    df = table.to_pandas()
+
+    if date_col in df.columns:
+        df[date_col] = pd.to_datetime(df[date_col])
+
+    # files saved with districts as numbers and as strings read back as
+    # strings, which then wouldn't match anything
+    if 'district' in df.columns:
+        df['district'] = df['district'].astype(int)
+
+    return df
+
+
+def combine(condition, new):
+    '''
+    AND a new filter condition onto an existing one (or none).
+
+    '''
+
+    if condition is None:
+        return new
+
+    return condition & new
@@ -4,36 +4,253 @@ Created on Sat Sep 12 13:49:13 2020
 @author: JonahKrop
 """
 
-import time
+import argparse
 import os
 
+from datetime import date, timedelta
+from functools import partial
+
+import refresh_daemon
+
+from pipeline import Pipeline, Stage
+
 '''
 Execute all the files necessary to produce today's Predictit market targets.
 
 1) Scrape 538 polling on House and Senate races
 2) Pull down the last 30 days of market pricing from several Predicit markets
-3) Make predictions for market prices and identify markets that are mispriced
+3) Pull the Economist's projected margins for each state
+4) Make predictions for market prices and identify markets that are mispriced
+
+Each step only runs if what it makes is out of date (see `pipeline`), so
+running this again after a step fails picks up where it left off, and a
+single step can be run by name. The scrapes don't depend on each other, so
+they run at the same time, as many as fit in the browser budget, and the
+modeling starts as soon as the polls and markets are in, so a full run
+takes about as long as the slowest scrape plus the modeling.
+
+    python daily_execute.py                 # whatever is out of date
+    python daily_execute.py modeling        # just the modeling
+    python daily_execute.py --force         # everything
+    python daily_execute.py --status        # what's up to date
+
+It can also keep running as a daemon (see `refresh_daemon`), with the
+browsers, the scrapers' worker processes, the party classifier, and R kept
+warm between refreshes. It refreshes everything every 15 minutes, or
+whenever asked:
+
+    python daily_execute.py --serve         # start it up
+    python daily_execute.py --send modeling # have it re-run the modeling
 
-Total takes 10 minutes to finish.
 '''
 
-# start timing
-t1 = time.time()
-
-# scrape senate and house polling from 538
-import scrape_538
-t2 = time.time()
-print('Finished scraping 538 after %.2f minutes \n' % ((t2 - t1) / 60))
-
-# scrape all the senate + house predictit markets (slow)
-import scrape_predictit_all
-t3 = time.time()
-print('Finished scraping predictit after %.1f minutes \n' % ((t3 - t2) / 60))
-
-# make predictions for market pricing and return targets in a .csv
-os.environ['R_HOME'] = '/Library/Frameworks/R.framework/Resources'
-import rpy2.robjects as robjects
-r_source = robjects.r['source']
-r_source('market_price_modeling.R')
-t4 = time.time()
-print('Finished marketplace predictions after %.1f minutes' % ((t4-t3) / 60))
+# how long scraped polls, markets, and margins count as up to date
+FRESH_FOR = 6 * 60 * 60  # seconds
+
+# how many stages to run at once, and most browsers open between them
+WORKERS = 3
+BROWSERS = 8
+
+# how many browsers each scrape opens
+POLL_BROWSERS = 4
+ECONOMIST_BROWSERS = 4
+
+# how often the daemon refreshes everything (0 to only refresh on request)
+REFRESH_MINUTES = 15
+
+# make predictions with the original R script or the python simulations.
+# R until the python fitter is checked against lme4 with both groupings
+MODELING = 'R'  # ['R', 'python']
+
+# where the R script can find R, unless R_HOME is already set
+R_HOME = '/Library/Frameworks/R.framework/Resources'
+
+
+def stages(warm=False):
+    '''
+    The daily stages, with the files each one reads and writes. With
+    `warm`, the scrapes keep their browsers and workers for the next run.
+
+    '''
+
+    import margin_store
+    import scrape_predictit_all
+    import simulate_markets
+
+    polls = ['_senate_polling.csv', '_house_polling.csv']
+    markets = [scrape_predictit_all.projects + 'all_predictit_markets.csv']
+
+    # targets are for yesterday's prices, like the modeling picks
+    today = date.today() - timedelta(days=1)
+    targets = [simulate_markets.TARGET_DIR + '%s-targets.csv' % today]
+
+    # fetching markets over http doesn't need a browser
+    market_browsers = scrape_predictit_all.workers
+    if scrape_predictit_all.backend != 'browser':
+        market_browsers = 0
+
+    return [
+        Stage('538', partial(scrape_polls, warm), outputs=polls,
+              ttl=FRESH_FOR, browsers=POLL_BROWSERS),
+        Stage('predictit', partial(scrape_markets, warm),
+              inputs=['predictit_market_urls.csv'], outputs=markets,
+              ttl=FRESH_FOR, browsers=market_browsers),
+        Stage('economist', partial(scrape_margins, warm),
+              outputs=[margin_store.STORE_PATH], ttl=FRESH_FOR,
+              browsers=ECONOMIST_BROWSERS),
+        Stage('modeling', model, inputs=polls + markets, outputs=targets)
+        ]
+
+
+def scrape_polls(warm=False):
+    '''
+    Scrape senate and house polling from 538, a few states at a time.
+
+    '''
+
+    import scrape_538
+    scrape_538.run(processes=POLL_BROWSERS, warm=warm)
+
+
+def scrape_markets(warm=False):
+    '''
+    Scrape all the senate + house predictit markets (slow).
+
+    '''
+
+    import scrape_predictit_all
+    scrape_predictit_all.main(scrape_predictit_all.workers,
+                              scrape_predictit_all.backend,
+                              scrape_predictit_all.incremental,
+                              warm)
+
+
+def scrape_margins(warm=False):
+    '''
+    Pull the Economist's projected margins for every state.
+
+    '''
+
+    import scrape_economist_statewide_margins
+    scrape_economist_statewide_margins.main(browsers=ECONOMIST_BROWSERS,
+                                            warm=warm)
+
+
+def model():
+    '''
+    Make predictions for market pricing and return targets in a .csv.
+
+    '''
+
+    if MODELING == 'python':
+        import simulate_markets
+        simulate_markets.main(workers=4)
+    else:
+        r_source = r_session().r['source']
+        r_source('market_price_modeling.R')
+
+
+def r_session():
+    '''
+    Start R with lme4 loaded (only slow the first time in a process).
+
+    '''
+
+    os.environ.setdefault('R_HOME', R_HOME)
+    import rpy2.robjects as robjects
+    robjects.r('suppressMessages(library(lme4))')
+
+    return robjects
+
+
+def warm_up():
+    '''
+    Load what's slow to start before the daemon's first refresh: the party
+    classifier, 538's worker processes, and R if we're modeling with it.
+    Browsers open on the first refresh and stay open after that.
+
+    '''
+
+    import predict_party
+    import scrape_538
+
+    predict_party.get_model()
+    scrape_538.warm_executor(POLL_BROWSERS)
+
+    if MODELING == 'R':
+        r_session()
+
+
+def refresh(only=None, force=False):
+    '''
+    Run the pipeline in the daemon, keeping everything warm. The stages get
+    made fresh each time, so the targets are always for the right day.
+
+    '''
+
+    pipeline = Pipeline(stages(warm=True))
+
+    return pipeline.run(only, force, WORKERS, BROWSERS)
+
+
+def serve(minutes=REFRESH_MINUTES):
+    '''
+    Run as a daemon, refreshing every `minutes` and whenever asked.
+
+    '''
+
+    import scrape_538
+
+    service = refresh_daemon.Daemon(refresh,
+                                    lambda: Pipeline(stages()).status(),
+                                    interval=minutes * 60)
+    try:
+        service.serve(warm_up)
+    finally:
+        # the warm browsers in this process get quit at exit, but 538's
+        # workers have to be shut down to quit theirs
+        scrape_538.close_warm_executor()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Make the daily targets.')
+    parser.add_argument('stages', nargs='*',
+                        help='only run these stages, up to date or not')
+    parser.add_argument('--force', action='store_true',
+                        help='run every stage, even if up to date')
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help='most stages to run at once')
+    parser.add_argument('--status', action='store_true',
+                        help="show which stages are up to date and stop")
+    parser.add_argument('--serve', action='store_true',
+                        help='keep running and refresh on a schedule')
+    parser.add_argument('--every', type=float, default=REFRESH_MINUTES,
+                        help='minutes between refreshes when serving')
+    parser.add_argument('--send', action='store_true',
+                        help='have the running daemon do this run')
+    args = parser.parse_args(args)
+
+    if args.serve:
+        serve(args.every)
+        return
+
+    if args.send:
+        request = ' '.join(['run'] + (['--force'] if args.force else []) +
+                           args.stages)
+        print(refresh_daemon.send(request))
+        return
+
+    pipeline = Pipeline(stages())
+
+    if args.status:
+        for name, fresh in pipeline.status().items():
+            print('%-10s %s' % (name, 'up to date' if fresh else 'stale'))
+        return
+
+    pipeline.run(args.stages or None, args.force, args.workers, BROWSERS)
+
+
+# scraping 538 starts worker processes that re-import this file, so only
+# run the pipeline when this file is run directly
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import atexit
+import queue
+import threading
+
+from contextlib import contextmanager
+from selenium import webdriver
+from selenium import common
+
+'''
+Keep warm Chrome sessions around for the whole run instead of starting a new
+browser for every page. Scrapers borrow a driver from a pool and hand it back
+when they're done. A driver gets quit and replaced after it's been used
+`max_uses` times, or right away if its session dies.
+
+'''
+
+CHROMEDRIVER = '/Users/JonahKrop/Documents/Projects/predictit/chromedriver'
+
+
+def new_driver(download_dir=None):
+    '''
+    Open up chrome, downloading files to `download_dir` if given.
+
+    '''
+
+    options = webdriver.ChromeOptions()
+    if download_dir is not None:
+        options.add_experimental_option('prefs', {
+            'download.default_directory': download_dir,
+            'download.prompt_for_download': False
+            })
+
+    driver = webdriver.Chrome(executable_path=CHROMEDRIVER, options=options)
+
+    return driver
+
+
+class DriverPool:
+    '''
+    A pool of up to `size` chrome sessions.
+
+        with pool.driver() as driver:
+            driver.get(url)
+
+    '''
+
+    def __init__(self, size=1, max_uses=25, download_dir=None):
+        self.size = size
+        self.max_uses = max_uses
+        self.download_dir = download_dir
+
+        # idle drivers and how many times they've been used
+        self._idle = queue.LifoQueue()
+        self._uses = {}
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        '''
+        Borrow a driver, waiting for one if all `size` are in use. Reuse a
+        warm one if it's still alive, otherwise start a new one.
+
+        '''
+
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    driver = self._idle.get_nowait()
+                except queue.Empty:
+                    driver = new_driver(self.download_dir)
+                    with self._lock:
+                        self._uses[driver] = 0
+                    return driver
+
+                # make sure the session didn't die while it sat around
+                if alive(driver):
+                    return driver
+                self._quit(driver)
+
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, driver, crashed=False):
+        '''
+        Hand a driver back. Quit it if it crashed or has been used up.
+
+        '''
+
+        with self._lock:
+            self._uses[driver] = self._uses.get(driver, 0) + 1
+            used_up = self._uses[driver] >= self.max_uses
+
+        if crashed or used_up:
+            self._quit(driver)
+        else:
+            self._idle.put(driver)
+
+        self._slots.release()
+
+    @contextmanager
+    def driver(self):
+        '''
+        Borrow a driver for a `with` block. A selenium error only gets the
+        driver replaced if its session died; a timeout or a missing element
+        just means the page was slow or bad.
+
+        '''
+
+        driver = self.acquire()
+        try:
+            yield driver
+        except common.exceptions.WebDriverException:
+            self.release(driver, crashed=not alive(driver))
+            raise
+        except BaseException:
+            self.release(driver)
+            raise
+        else:
+            self.release(driver)
+
+    def close(self):
+        '''
+        Quit every idle driver.
+
+        '''
+
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._quit(driver)
+
+    def _quit(self, driver):
+        with self._lock:
+            self._uses.pop(driver, None)
+        try:
+            driver.quit()
+        except common.exceptions.WebDriverException:
+            pass
+
+
+def alive(driver):
+    '''
+    Return whether a driver's browser session still answers.
+
+    '''
+
+    if driver.session_id is None:
+        return False
+
+    try:
+        driver.title
+        return True
+    except common.exceptions.WebDriverException:
+        return False
+
+
+# one pool shared by every scraper in the process
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def default_pool():
+    '''
+    Return the process-wide driver pool, creating it the first time.
+
+    '''
+
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = DriverPool()
+            atexit.register(_pool.close)
+
+    return _pool
+
+
+def close_default_pool():
+    '''
+    Quit the process-wide pool's drivers, if it ever started any. Worker
+    processes from a process pool don't run `atexit`, so they need to call
+    this themselves on the way out.
+
+    '''
+
+    with _pool_lock:
+        pool = _pool
+
+    if pool is not None:
+        pool.close()
+
+
+# pools a long-lived process keeps open between runs, by name
+_warm_pools = {}
+
+
+def warm_pool(name, size=1, download_dir=None):
+    '''
+    Return the process-wide pool called `name`, creating it the first time.
+    Unlike the pools scrapers make for one run, it stays open, drivers and
+    all, until the process exits.
+
+    '''
+
+    with _pool_lock:
+        if name not in _warm_pools:
+            _warm_pools[name] = DriverPool(size=size,
+                                           download_dir=download_dir)
+            atexit.register(_warm_pools[name].close)
+
+    return _warm_pools[name]
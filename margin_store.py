@@ -0,0 +1,160 @@
+import glob
+import re
+import sqlite3
+
+import pandas as pd
+
+from datetime import date
+from time import time
+
+'''
+Keep every pull of the Economist's projected margins in one place, instead of
+a new `economist_projected_margins_MM_DD.csv` each day that nothing reads
+back. Pulls only ever get added, never changed, so the store is a full
+history of each state's projection: look up a state's trajectory, or ask
+which states moved since the last pull so only those need re-reading.
+
+'''
+
+STORE_PATH = 'economist_margins.sqlite'
+
+MARGIN_COLUMNS = ['state', 'date', 'biden', 'trump', 'margin']
+
+
+class MarginStore:
+    '''
+    An append-only store of projected margins, one row per state per pull.
+
+        store.append(df)
+        store.trajectory('PA')
+        store.delta_report()
+
+    '''
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+
+        with self._connect() as db:
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS margins (
+                    state TEXT, date TEXT, biden REAL, trump REAL,
+                    margin REAL, pulled_at REAL)
+                ''')
+            db.execute('''
+                CREATE INDEX IF NOT EXISTS margins_state_date
+                ON margins (state, date)
+                ''')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def append(self, margins, day=None):
+        '''
+        Add a pull of margins (a DataFrame with state, biden, trump and
+        margin columns) taken on `day` (today by default).
+
+        '''
+
+        day = (day or date.today()).isoformat()
+        pulled_at = time()
+
+        rows = [(state, day, float(biden), float(trump), float(margin),
+                 pulled_at)
+                for state, biden, trump, margin in zip(
+                    margins['state'], margins['biden'], margins['trump'],
+                    margins['margin']
+                    )]
+
+        with self._connect() as db:
+            db.executemany('INSERT INTO margins VALUES (?, ?, ?, ?, ?, ?)',
+                           rows)
+
+        return len(rows)
+
+    def trajectory(self, state, start=None, end=None):
+        '''
+        Return a state's projected margins over time (the last pull of each
+        day), between `start` and `end` if given.
+
+        '''
+
+        query = '''
+            SELECT %s FROM margins
+            WHERE state = ? AND date >= ? AND date <= ?
+            ORDER BY date, pulled_at
+            ''' % ', '.join(MARGIN_COLUMNS)
+        start = str(pd.Timestamp(start).date()) if start else ''
+        end = str(pd.Timestamp(end).date()) if end else '9999'
+
+        with self._connect() as db:
+            df = pd.read_sql_query(query, db, params=(state, start, end))
+
+        df = df.drop_duplicates('date', keep='last').reset_index(drop=True)
+        df['date'] = pd.to_datetime(df['date'])
+
+        return df
+
+    def delta_report(self, min_change=0.0):
+        '''
+        Compare each state's latest pull with the one before it, and return
+        the states whose margin moved by more than `min_change`, biggest
+        moves first. States pulled for the first time count as moved.
+
+        '''
+
+        query = '''
+            SELECT state, date, margin FROM (
+                SELECT state, date, margin, ROW_NUMBER() OVER (
+                    PARTITION BY state
+                    ORDER BY date DESC, pulled_at DESC) AS pull
+                FROM margins)
+            WHERE pull <= 2
+            ORDER BY state, pull
+            '''
+
+        with self._connect() as db:
+            pulls = pd.read_sql_query(query, db)
+
+        latest = pulls.groupby('state').nth(0).set_index('state')
+        previous = pulls.groupby('state').nth(1).set_index('state')
+
+        report = pd.DataFrame({
+            'date': latest['date'],
+            'margin': latest['margin'],
+            'previous_date': previous['date'].reindex(latest.index),
+            'previous_margin': previous['margin'].reindex(latest.index)
+            })
+        report['change'] = report['margin'] - report['previous_margin']
+
+        moved = ((report['change'].abs() > min_change) |
+                 report['previous_margin'].isna())
+        report = report[moved].reset_index()
+
+        order = report['change'].abs().fillna(float('inf'))
+        report = report.loc[order.sort_values(ascending=False).index]
+
+        return report.reset_index(drop=True)
+
+    def changed_states(self, min_change=0.0):
+        '''
+        Return the states whose margin moved since the last pull.
+
+        '''
+
+        return list(self.delta_report(min_change)['state'])
+
+
+def backfill(store, pattern='economist_projected_margins_*.csv', year=2020):
+    '''
+    Add the old daily .csv's to the store. Their names only have the month
+    and day, so `year` says which year they're from.
+
+    '''
+
+    added = 0
+    for path in sorted(glob.glob(pattern)):
+        month, day = re.findall(r'(\d{2})_(\d{2})\.csv$', path)[0]
+        pulled = date(year, int(month), int(day))
+        added += store.append(pd.read_csv(path), pulled)
+
+    return added
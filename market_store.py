@@ -0,0 +1,166 @@
+import os
+
+import pandas as pd
+
+'''
+Keep every day of Predictit.com market history we've ever pulled, so each
+run only has to fetch the days we don't have yet. Rows are keyed by
+(market_url, contract, market_date); fetching a day again replaces it, so
+today's still-moving prices get updated on every run.
+
+'''
+
+STORE_NAME = 'predictit_history.csv'
+
+STORE_COLUMNS = [
+    'market_url',
+    'election',
+    'state',
+    'district',
+    'incumbent',
+    'contract',
+    'volume',
+    'market_date',
+    'price'
+    ]
+
+KEY = ['market_url', 'contract', 'market_date']
+
+# date ranges to fetch with and how many whole days each one covers, up to
+# and including today. 24hr and 7d come back as points during the day, and
+# start partway through their first day, so that day doesn't count
+DATE_RANGES = [('24hr', 1), ('7d', 6), ('30d', 30), ('90d', 90)]
+
+# date ranges that come back as points during the day
+INTRADAY = ['24hr', '7d']
+
+# the downloaded .csv's date format
+DATE_FORMAT = '%m/%d/%Y %I:%M:%S %p'
+
+# how many days of history the modeling gets, same as a 30 day pull
+OUTPUT_DAYS = 30
+
+
+def load_store(path=STORE_NAME):
+    '''
+    Load the market history, or an empty one if we haven't started it yet.
+
+    '''
+
+    if not os.path.exists(path):
+        store = pd.DataFrame(columns=STORE_COLUMNS)
+    else:
+        store = pd.read_csv(path)
+
+    store['market_date'] = pd.to_datetime(store['market_date'])
+
+    return store
+
+
+def save_store(store, path=STORE_NAME):
+    '''
+    Write the market history back out, replacing the file all at once so a
+    crash can't leave it half written.
+
+    '''
+
+    temp_path = path + '.tmp'
+    store.to_csv(temp_path, index=False)
+    os.replace(temp_path, path)
+
+
+def latest_dates(store):
+    '''
+    Return a dict of each market's most recent day in the store.
+
+    '''
+
+    latest = store.groupby('market_url')['market_date'].max()
+
+    return {url: day.date() for url, day in latest.items()}
+
+
+def choose_date_range(latest, today):
+    '''
+    Pick the smallest date range that covers every whole day since the
+    latest day we have for a market (including that day, which may have been
+    pulled before it was over). Markets we've never seen get the most
+    history predictit will give us.
+
+    '''
+
+    if latest is None:
+        return DATE_RANGES[-1][0]
+
+    gap = (today - latest).days
+
+    for date_range, days in DATE_RANGES:
+        if days > gap:
+            return date_range
+
+    return DATE_RANGES[-1][0]
+
+
+def daily(market, date_range):
+    '''
+    Turn a downloaded market with points during the day (24hr and 7d) into
+    one row per contract per day, like a 30d download: the day's last
+    prices and its total volume. The first day only has the points since
+    the range started, so it gets dropped rather than replace a whole day
+    we already have. Daily markets come back as they are.
+
+    '''
+
+    if date_range not in INTRADAY:
+        return market
+
+    when = pd.to_datetime(market['Date'], format=DATE_FORMAT)
+    market = market.assign(day=when.dt.normalize(), when=when)
+    market = market[market['day'] > market['day'].min()]
+    market = market.sort_values(['ContractName', 'when'], kind='stable')
+
+    days = market.groupby(['ContractName', 'day'], sort=False)
+    volume = days['TradeVolume'].sum().values
+
+    market = days.tail(1).drop(columns=['day', 'when'])
+    market['TradeVolume'] = volume
+
+    return market.reset_index(drop=True)
+
+
+def recent(store, today, urls=None, days=OUTPUT_DAYS):
+    '''
+    Return the last `days` days of the store, through `today`, for just the
+    markets in `urls` if given (so markets we've stopped following drop
+    out, like they would from a full pull).
+
+    '''
+
+    first = pd.Timestamp(today) - pd.Timedelta(days=days - 1)
+    keep = store['market_date'] >= first
+
+    if urls is not None:
+        keep &= store['market_url'].isin(list(urls))
+
+    return store[keep].reset_index(drop=True)
+
+
+def upsert(store, markets):
+    '''
+    Add newly fetched market rows to the store, replacing any rows we
+    already had for the same (market_url, contract, market_date).
+
+    '''
+
+    markets = markets[STORE_COLUMNS].copy()
+    markets['market_date'] = pd.to_datetime(markets['market_date'])
+
+    if len(store) == 0:
+        store = markets
+    else:
+        store = pd.concat([store[STORE_COLUMNS], markets], axis=0)
+
+    store = store.drop_duplicates(KEY, keep='last')
+    store = store.sort_values(KEY).reset_index(drop=True)
+
+    return store
@@ -0,0 +1,201 @@
+import numpy as np
+
+from scipy.linalg import solve_triangular
+from scipy.optimize import minimize
+
+'''
+Fit `y ~ X + (1|group1) + (1|group2) + ...` (random intercepts only) by REML,
+the same fit lme4's lmer makes, but fast enough to refit hundreds of times.
+
+Everything the fit needs from the data is in the cross-products of
+[Z X y], where Z has a 0/1 column for each level of each grouping. With a
+handful of levels that's a small matrix no matter how many rows there are,
+so each step of the optimizer is one small Cholesky factorization (lme4's
+profiled REML criterion, Bates et al. 2015) instead of a pass over the data.
+The cross-products for a whole batch of datasets that share the same groups
+get built together, and each fit starts from the last one's solution.
+
+'''
+
+LOG_2PI = np.log(2 * np.pi)
+
+
+class RandomIntercepts:
+    '''
+    The random intercept structure shared by every dataset in a batch: the
+    levels of each grouping, for each row.
+
+        model = RandomIntercepts({'contract': contracts})
+        fits = model.fit_batch(X, y, mask)
+
+    '''
+
+    def __init__(self, groups):
+        self.names = list(groups)
+        self.levels, columns, self.group_of = [], [], []
+
+        for k, name in enumerate(self.names):
+            codes, uniques = factorize(groups[name])
+            self.levels.append(list(uniques))
+            columns.append(np.eye(len(uniques))[codes])
+            self.group_of.extend([k] * len(uniques))
+
+        self.Z = np.concatenate(columns, axis=1)
+        self.group_of = np.array(self.group_of)
+        self.q = self.Z.shape[1]
+
+        # where the last fit ended up, to start the next one from
+        self.theta = np.ones(len(self.names))
+
+    def cross_products(self, X, y, mask=None):
+        '''
+        Return [Z X y]'[Z X y] for each dataset in a batch, and how many
+        rows each one has. `X` is (datasets x rows x fixed effects), `y` is
+        (rows,), and `mask` (datasets x rows) picks the rows in each.
+
+        '''
+
+        datasets, n, p = X.shape
+        if mask is None:
+            mask = np.ones((datasets, n), dtype=bool)
+
+        Z = np.broadcast_to(self.Z, (datasets, n, self.q))
+        Y = np.broadcast_to(y[:, None], (datasets, n, 1))
+        D = np.concatenate([Z, X, Y], axis=2)
+
+        weighted = D * mask[:, :, None]
+        products = np.matmul(weighted.transpose(0, 2, 1), D)
+
+        return products, mask.sum(axis=1)
+
+    def fit_batch(self, X, y, mask=None, start=None):
+        '''
+        Fit every dataset in a batch (see `cross_products`) and return a
+        list of fits (see `fit`). Each fit starts from the one before it,
+        or they all start from `start` (a theta) if it's given, so each
+        fit doesn't depend on what else is in the batch.
+
+        '''
+
+        products, rows = self.cross_products(X, y, mask)
+
+        return [self.fit(products[s], rows[s], start)
+                for s in range(len(rows))]
+
+    def fit(self, products, n, start=None):
+        '''
+        Fit one dataset from its cross-products and number of rows, starting
+        from `start` or else the last fit's solution. Returns a dict of:
+            - fixed: fixed effects
+            - random: {group: {level: random intercept}}
+            - theta: each group's sd relative to the residual sd
+            - sigma: residual sd
+            - deviance: the REML criterion (lmer's REMLcrit)
+
+        '''
+
+        p = products.shape[0] - self.q - 1
+
+        if start is None:
+            start = self.theta
+
+        result = self.optimize(start, products, n)
+
+        # the criterion is flat in theta at 0, so a fit that lands on the
+        # bound can stop there; check it against a fit from lme4's start
+        if np.any(result.x == 0):
+            again = self.optimize(np.ones(len(start)), products, n)
+            if again.fun < result.fun:
+                result = again
+
+        self.theta = result.x
+
+        return self.solve(result.x, products, n, p)
+
+    def optimize(self, start, products, n):
+        '''
+        Minimize the criterion over theta >= 0 from `start`, derivative
+        free like lme4 (a gradient method stops on the bound at 0).
+
+        '''
+
+        return minimize(self.deviance, start, args=(products, n),
+                        method='Nelder-Mead',
+                        bounds=[(0, None)] * len(start),
+                        options={'xatol': 1e-8, 'fatol': 1e-10})
+
+    def deviance(self, theta, products, n):
+        '''
+        Profiled REML criterion at `theta`.
+
+        '''
+
+        p = products.shape[0] - self.q - 1
+
+        L = self.factor(theta, products)
+        if L is None:
+            return np.inf
+
+        diag = np.log(np.diag(L)[:-1])
+        log_det_z = 2 * diag[:self.q].sum()
+        log_det_x = 2 * diag[self.q:].sum()
+        rss = max(L[-1, -1] ** 2, 1e-300)
+
+        return (log_det_z + log_det_x +
+                (n - p) * (1 + LOG_2PI + np.log(rss / (n - p))))
+
+    def factor(self, theta, products):
+        '''
+        Cholesky factor of the cross-products with the random effects scaled
+        by `theta` and penalized, or None if it isn't positive definite.
+        Its diagonal has everything the criterion needs, and the last row
+        solves for the effects.
+
+        '''
+
+        scale = np.ones(products.shape[0])
+        scale[:self.q] = theta[self.group_of]
+
+        A = products * scale[:, None] * scale[None, :]
+        A[:self.q, :self.q] += np.eye(self.q)
+
+        try:
+            return np.linalg.cholesky(A)
+        except np.linalg.LinAlgError:
+            return None
+
+    def solve(self, theta, products, n, p):
+        '''
+        Fixed effects, random intercepts, and residual sd at `theta`.
+
+        '''
+
+        L = self.factor(theta, products)
+
+        effects = solve_triangular(L[:-1, :-1].T, L[-1, :-1], lower=False)
+        u, fixed = effects[:self.q], effects[self.q:]
+        b = theta[self.group_of] * u
+
+        random, start = {}, 0
+        for name, levels in zip(self.names, self.levels):
+            random[name] = dict(zip(levels, b[start:start + len(levels)]))
+            start += len(levels)
+
+        return {
+            'fixed': fixed,
+            'random': random,
+            'theta': theta.copy(),
+            'sigma': np.sqrt(L[-1, -1] ** 2 / (n - p)),
+            'deviance': self.deviance(theta, products, n)
+            }
+
+
+def factorize(levels):
+    '''
+    Codes and sorted unique values for `levels`, like lme4's factor levels.
+
+    '''
+
+    uniques, codes = np.unique(np.asarray(levels), return_inverse=True)
+
+    return codes, uniques
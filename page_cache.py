@@ -0,0 +1,221 @@
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+
+from time import time
+
+'''
+Keep a copy of every page and .csv the scrapers fetch, so parsing can be
+re-run from what we already have instead of scraping everything again.
+
+Snapshots are saved compressed under the hash of their contents (the same
+page fetched twice is only saved once), and an index records what each one
+is (`kind`, e.g. '538', and `key`, e.g. 'senate/maine') and when it was
+fetched. Old snapshots get cleared out by age and total size.
+
+'''
+
+CACHE_DIR = 'page_cache'
+
+# how long to keep snapshots, and the most space they can take up
+MAX_AGE_DAYS = 30
+MAX_BYTES = 2 * 1024 ** 3
+
+
+class PageCache:
+    '''
+    A content-addressed store of fetched pages.
+
+        digest = cache.put('538', 'senate/maine', html)
+        html = cache.latest('538', 'senate/maine')
+
+    '''
+
+    def __init__(self, root=CACHE_DIR):
+        self.root = root
+        self.objects = os.path.join(root, 'objects')
+        os.makedirs(self.objects, exist_ok=True)
+
+        self.index_path = os.path.join(root, 'index.sqlite')
+        with self._connect() as db:
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    kind TEXT, key TEXT, digest TEXT,
+                    fetched_at REAL, size INTEGER)
+                ''')
+            db.execute('''
+                CREATE INDEX IF NOT EXISTS snapshots_kind_key
+                ON snapshots (kind, key, fetched_at)
+                ''')
+
+    def _connect(self):
+        # a connection per call, so threads and processes can share a cache
+        return sqlite3.connect(self.index_path, timeout=30)
+
+    def _path(self, digest):
+        return os.path.join(self.objects, digest[:2], digest + '.gz')
+
+    def put(self, kind, key, data):
+        '''
+        Save a snapshot of `data` (bytes, or a str to save as utf-8) and
+        return its digest.
+
+        '''
+
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+
+        # same contents, same file -- only write it the first time, but
+        # touch it again so `evict` elsewhere doesn't take it for old
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = '%s.%s.%s.tmp' % (path, os.getpid(),
+                                          threading.get_ident())
+            with open(temp_path, 'wb') as f:
+                f.write(gzip.compress(data))
+            os.replace(temp_path, path)
+
+        with self._connect() as db:
+            db.execute('INSERT INTO snapshots VALUES (?, ?, ?, ?, ?)',
+                       (kind, key, digest, time(), os.path.getsize(path)))
+
+        return digest
+
+    def get(self, digest):
+        '''
+        Return the bytes saved under `digest`, or None if they're gone
+        (another process can evict them after the index points at them).
+
+        '''
+
+        try:
+            with gzip.open(self._path(digest), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def latest(self, kind, key, before=None):
+        '''
+        Return the most recent snapshot for (`kind`, `key`), or the most
+        recent one fetched before the timestamp `before`. None if there
+        isn't one.
+
+        '''
+
+        if before is None:
+            before = float('inf')
+
+        with self._connect() as db:
+            row = db.execute('''
+                SELECT digest FROM snapshots
+                WHERE kind = ? AND key = ? AND fetched_at < ?
+                ORDER BY fetched_at DESC LIMIT 1
+                ''', (kind, key, before)).fetchone()
+
+        if row is None:
+            return None
+
+        return self.get(row[0])
+
+    def fetched_at(self, kind, key):
+        '''
+        Return when the most recent snapshot for (`kind`, `key`) was
+        fetched, as a timestamp, or None if there isn't one.
+
+        '''
+
+        with self._connect() as db:
+            row = db.execute('''
+                SELECT MAX(fetched_at) FROM snapshots
+                WHERE kind = ? AND key = ?
+                ''', (kind, key)).fetchone()
+
+        return row[0]
+
+    def keys(self, kind):
+        '''
+        Return every key with a snapshot of `kind`.
+
+        '''
+
+        with self._connect() as db:
+            rows = db.execute('''
+                SELECT DISTINCT key FROM snapshots WHERE kind = ?
+                ORDER BY key
+                ''', (kind,)).fetchall()
+
+        return [row[0] for row in rows]
+
+    def evict(self, max_age_days=MAX_AGE_DAYS, max_bytes=MAX_BYTES):
+        '''
+        Forget snapshots older than `max_age_days`, then the oldest ones
+        until the rest fit in `max_bytes`, and delete files nothing points
+        to anymore.
+
+        '''
+
+        with self._connect() as db:
+            db.execute('DELETE FROM snapshots WHERE fetched_at < ?',
+                       (time() - max_age_days * 24 * 60 * 60,))
+
+            # newest first, keeping files until we run out of room
+            rows = db.execute('''
+                SELECT rowid, digest, size FROM snapshots
+                ORDER BY fetched_at DESC
+                ''').fetchall()
+
+            total, seen, dropped = 0, set(), []
+            for rowid, digest, size in rows:
+                if digest not in seen:
+                    seen.add(digest)
+                    total += size
+                if total > max_bytes:
+                    dropped.append((rowid,))
+            db.executemany('DELETE FROM snapshots WHERE rowid = ?', dropped)
+
+            kept = set(row[0] for row in
+                       db.execute('SELECT DISTINCT digest FROM snapshots'))
+
+        # leave brand new files alone, they may be mid-save somewhere else
+        cutoff = time() - 60 * 60
+        for folder in os.listdir(self.objects):
+            for name in os.listdir(os.path.join(self.objects, folder)):
+                path = os.path.join(self.objects, folder, name)
+                if (not name.endswith('.gz')) or (name[:-3] in kept):
+                    continue
+
+                # another process may be clearing out the same files
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+# one cache for the whole process
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def default_cache():
+    '''
+    Return the shared page cache, clearing out old snapshots the first
+    time it's used.
+
+    '''
+
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = PageCache()
+            _cache.evict()
+
+    return _cache
@@ -0,0 +1,258 @@
+import os
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+'''
+Run the daily steps as a graph of stages instead of one long script. Each
+stage says which files it reads and which it writes, which is all it takes
+to know what has to run before what: a stage comes after every stage that
+writes one of its inputs.
+
+A stage gets skipped when its outputs are up to date: they all exist, they
+are newer than all of its inputs, and (for stages that pull from the web,
+which have a `ttl`) they were written less than `ttl` seconds ago. So after
+a failure, running again only redoes the stage that failed and the ones
+after it, and any one stage can be run again on its own.
+
+Stages that don't depend on each other can run at the same time, up to
+`workers` at once and with no more than `browsers` browsers open between
+them (each stage says how many it opens). A stage starts as soon as
+everything upstream of it is done.
+
+    pipeline = Pipeline([Stage('polls', scrape, outputs=['polls.csv']),
+                         Stage('model', fit, inputs=['polls.csv'],
+                               outputs=['targets.csv'])])
+    pipeline.run()                  # whatever isn't up to date
+    pipeline.run(['model'])         # just the model, up to date or not
+    pipeline.run(workers=2)         # independent stages at the same time
+
+'''
+
+
+class Stage:
+    '''
+    One step of the pipeline: `run` gets called with no arguments, reads
+    the files in `inputs`, and writes the files in `outputs`. Outputs
+    older than `ttl` seconds are out of date even if the inputs haven't
+    changed. `browsers` is how many browsers it opens while it runs.
+
+    '''
+
+    def __init__(self, name, run, inputs=(), outputs=(), ttl=None,
+                 browsers=0):
+        self.name = name
+        self.run = run
+        self.inputs = [full_path(path) for path in inputs]
+        self.outputs = [full_path(path) for path in outputs]
+        self.ttl = ttl
+        self.browsers = browsers
+
+    def fresh(self, now=None):
+        '''
+        Return whether the stage's outputs are up to date.
+
+        '''
+
+        written = [modified(path) for path in self.outputs]
+        if (len(written) == 0) or (None in written):
+            return False
+
+        oldest = min(written)
+
+        # an input that doesn't exist yet hasn't changed
+        read = [t for t in map(modified, self.inputs) if t is not None]
+        if (len(read) > 0) and (max(read) > oldest):
+            return False
+
+        if self.ttl is not None:
+            now = time.time() if now is None else now
+            if now - oldest > self.ttl:
+                return False
+
+        return True
+
+
+class Pipeline:
+    '''
+    Stages in the order they have to run in.
+
+    '''
+
+    def __init__(self, stages):
+        self.stages = {stage.name: stage for stage in stages}
+        self.order = self._order(stages)
+
+    def upstream(self, name):
+        '''
+        Return the names of the stages that write one of `name`'s inputs.
+
+        '''
+
+        inputs = set(self.stages[name].inputs)
+
+        return [other.name for other in self.stages.values()
+                if (other.name != name) and (inputs & set(other.outputs))]
+
+    def _order(self, stages):
+        '''
+        Sort the stages so each one comes after everything upstream of it,
+        keeping the order they were given in otherwise.
+
+        '''
+
+        order, done = [], set()
+        while len(order) < len(stages):
+            ready = [stage.name for stage in stages
+                     if (stage.name not in done) and
+                     set(self.upstream(stage.name)) <= done]
+            if len(ready) == 0:
+                raise ValueError('stages depend on each other in a loop')
+
+            order.append(ready[0])
+            done.add(ready[0])
+
+        return order
+
+    def status(self):
+        '''
+        Return {stage name: whether it's up to date}, in order.
+
+        '''
+
+        return {name: self.stages[name].fresh() for name in self.order}
+
+    def run(self, only=None, force=False, workers=1, browsers=None):
+        '''
+        Run every stage that isn't up to date, or just the stages in `only`
+        whether they're up to date or not. With `force`, run all of them.
+
+        Up to `workers` stages run at once, each starting once the stages
+        upstream of it are done, and stages only start while their browsers
+        fit within `browsers` (a stage that wants more than that gets the
+        whole budget to itself). After a stage fails, no new stages start;
+        the ones already running finish, then the failure is raised, so
+        nothing runs on stale inputs. Returns the names of the stages run.
+
+        '''
+
+        if only is not None:
+            unknown = set(only) - set(self.stages)
+            if unknown:
+                raise ValueError('no stage named %s' %
+                                 ', '.join(sorted(unknown)))
+
+        pending = [name for name in self.order
+                   if (only is None) or (name in only)]
+        workers = max(1, workers)
+
+        ran, running, failure = [], {}, None
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while pending or running:
+                # start what can start, again after skipping stages that
+                # are up to date, since that can free up the ones after them
+                while failure is None:
+                    startable = self._startable(pending, running, browsers,
+                                                workers)
+                    if len(startable) == 0:
+                        break
+
+                    for name in startable:
+                        pending.remove(name)
+                        stage = self.stages[name]
+
+                        if (only is None) and (not force) and stage.fresh():
+                            print('%s is up to date, skipping it \n' % name)
+                            continue
+
+                        running[executor.submit(run_stage, stage)] = name
+
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        future.result()
+                        ran.append(name)
+                    except Exception as error:
+                        print('%s failed: %r \n' % (name, error))
+                        failure = failure or error
+
+        if failure is not None:
+            raise failure
+
+        return ran
+
+    def _startable(self, pending, running, browsers, workers):
+        '''
+        Return the pending stages that can start now, in order: nothing
+        upstream of them is still to run, and there's room for them in the
+        worker and browser budgets.
+
+        '''
+
+        waiting = set(pending) | set(running.values())
+        in_use = sum(self._browsers(running[f], browsers) for f in running)
+        slots = workers - len(running)
+
+        startable = []
+        for name in pending:
+            if slots <= 0:
+                break
+            if set(self.upstream(name)) & waiting:
+                continue
+
+            needed = self._browsers(name, browsers)
+            if (browsers is not None) and (in_use + needed > browsers):
+                continue
+
+            startable.append(name)
+            in_use += needed
+            slots -= 1
+
+        return startable
+
+    def _browsers(self, name, budget):
+        '''
+        How many browsers stage `name` gets counted as using.
+
+        '''
+
+        needed = self.stages[name].browsers
+
+        return needed if budget is None else min(needed, budget)
+
+
+def run_stage(stage):
+    '''
+    Run one stage and say how long it took.
+
+    '''
+
+    start = time.time()
+    stage.run()
+    print('Finished %s after %.1f minutes \n' %
+          (stage.name, (time.time() - start) / 60))
+
+
+def full_path(path):
+    '''
+    Absolute path for `path`, so stages can name the same file differently.
+
+    '''
+
+    return os.path.abspath(os.path.expanduser(path))
+
+
+def modified(path):
+    '''
+    When the file at `path` was last written, or None if it doesn't exist.
+
+    '''
+
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
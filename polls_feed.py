@@ -0,0 +1,172 @@
+import re
+
+import numpy as np
+import pandas as pd
+import unidecode
+
+'''
+Read 538's published polls data (the .csv's behind their polls pages) and
+turn it into the same columns `scrape_538` gets from scraping the pages, so
+no browser is needed. A feed can come from 538's site or a local .csv/.json
+file with the same fields.
+
+'''
+
+FEED_URL = 'https://projects.fivethirtyeight.com/polls-page/'
+FEED_URLS = {
+    'senate': FEED_URL + 'senate_polls.csv',
+    'house': FEED_URL + 'house_polls.csv'
+    }
+
+# 538's date format, e.g. 9/10/20
+DATE_FORMAT = '%m/%d/%y'
+
+# scraping stops once it's back to polls from before June, 2020
+FIRST_POLL_DATE = '2020-06-01'
+
+PARTIES = {'DEM': 'Democratic', 'REP': 'Republican'}
+
+POLL_COLUMNS = [
+    'poll_id',
+    'election',
+    'state',
+    'district',
+    'poll_date',
+    'pollster',
+    'sponsored',
+    'pollster_grade',
+    'poll_sample',
+    'voter_type',
+    'candidate',
+    'party',
+    'polling',
+    'net_polling'
+    ]
+
+
+def load_polls(election, source=None, state=''):
+    '''
+    Load one chamber's 2020 general election polls from the feed (538's
+    by default, or a local file) for every state, or just `state` (e.g.
+    'north-carolina').
+
+    '''
+
+    if source is None:
+        source = FEED_URLS[election]
+
+    feed = read_feed(source)
+    polls = feed_to_polls(feed, election)
+
+    if state != '':
+        polls = polls[polls['state'] == state.replace('-', ' ')]
+        polls = polls.reset_index(drop=True)
+
+    return polls
+
+
+def read_feed(source):
+    '''
+    Read a feed from a url or file, as .json (a list of records) or .csv.
+
+    '''
+
+    if str(source).endswith('.json'):
+        return pd.read_json(source, orient='records', dtype=False)
+
+    return pd.read_csv(source, low_memory=False)
+
+
+def feed_to_polls(feed, election):
+    '''
+    Map the feed's fields onto the scraped polling columns:
+        - one poll per question (matchup) in the feed
+        - poll date is the day the poll finished
+        - partisan and internal polls are the ones 538 marks as sponsored
+        - candidate names and polling cleaned up like the scraped ones
+        - net polling is the leader's margin over the runner up
+
+    '''
+
+    feed = feed[(feed['cycle'] == 2020) &
+                (feed['stage'] == 'general') &
+                feed['state'].notna()].copy()
+
+    if 'ranked_choice_reallocated' in feed.columns:
+        feed = feed[~flag(feed['ranked_choice_reallocated'])]
+
+    feed['end_date'] = pd.to_datetime(feed['end_date'], format=DATE_FORMAT)
+    feed = feed[feed['end_date'] >= FIRST_POLL_DATE]
+
+    # drop answers without a candidate or polling, which a page can't show
+    feed = feed[feed['answer'].notna() & feed['pct'].notna()]
+
+    polls = pd.DataFrame({
+        'poll_id': feed['question_id'].astype(str),
+        'election': election,
+        'state': feed['state'].str.lower(),
+        'poll_date': feed['end_date'].dt.strftime('%Y-%m-%d'),
+        'pollster': feed['display_name'].fillna(feed['pollster']),
+        'sponsored': (feed['partisan'].notna() |
+                      flag(feed['internal'])).astype(int),
+        'pollster_grade': feed['fte_grade'],
+        'poll_sample': feed['sample_size'],
+        'voter_type': feed['population'].str.upper(),
+        'candidate': [clean_name(name) for name in feed['answer']],
+        'party': feed['candidate_party'].map(PARTIES).fillna('Independent'),
+        # round halves up like the page does (round() would make 48.5 48)
+        'polling': np.floor(feed['pct'] + 0.5)
+        })
+
+    if election == 'house':
+        polls['district'] = feed['seat_number'].fillna(0).astype(int)
+    else:
+        polls['district'] = 0
+
+    # drop polls without a sample size, like the scraped ones can't have
+    polls = polls[polls['poll_sample'].notna()]
+    polls['poll_sample'] = polls['poll_sample'].astype(int)
+    polls['polling'] = polls['polling'].astype(int)
+
+    # leader's margin over the runner up in each poll
+    polls['net_polling'] = polls.groupby('poll_id')['polling'].transform(
+        net_polling
+        )
+
+    return polls[POLL_COLUMNS].reset_index(drop=True)
+
+
+def flag(column):
+    '''
+    Return where a true/false column of the feed is true. Blanks count as
+    false (a plain astype(bool) would make them true), and so do 'false'
+    strings from a .json fixture.
+
+    '''
+
+    return column.astype(str).str.lower().isin(['true', '1', '1.0'])
+
+
+def net_polling(polling):
+    '''
+    Return the margin between the top two candidates in a poll (0 if
+    there's only one).
+
+    '''
+
+    top = np.sort(polling.values)[::-1]
+
+    if len(top) < 2:
+        return 0
+
+    return int(top[0] - top[1])
+
+
+def clean_name(name):
+    '''
+    Clean a candidate name the way the scraped ones are: only letters and
+    numbers, with no accents.
+
+    '''
+
+    return unidecode.unidecode(re.sub(r'\W+', '', str(name)))
@@ -1,12 +1,21 @@
+import os
+import pickle
+
 import pandas as pd
 import numpy as np
 import seaborn as sns
+import sklearn
 from sklearn.svm import SVC
 
 '''
 Use a linear SVC to classify polling result RGB color as a political party.
 Only need to use green and blue. All Rep. and many Ind. have r = 255, while
-green and blue vary for all 3 options. 
+green and blue vary for all 3 options.
+
+The model is fit once per process (or loaded from `party_svc.pkl` if it was
+saved after the last change to `rgb_party.csv`, by the same version of
+scikit-learn), and every (green, blue) pair
+it has classified is remembered so repeat colors skip the model entirely.
 
 '''
 
@@ -15,19 +24,97 @@ green and blue vary for all 3 options.
 # df = pd.read_csv('rgb_party.csv')
 # sns.scatterplot(df.blue, df.green, hue=df.party)
 
+TRAINING_PATH = 'rgb_party.csv'
+MODEL_PATH = 'party_svc.pkl'
 
-def predict_party(rgb):
+# process-wide model and (green, blue) -> party lookup table
+_model = None
+_party_lookup = {}
+
+
+def get_model():
+    '''
+    Return the fitted party classifier, fitting it at most once per process.
+
+    Use the saved model if it's newer than the training data, otherwise fit
+    a new one and save it for next time.
+
+    '''
+
+    global _model
+
+    if _model is not None:
+        return _model
+
+    if (os.path.exists(MODEL_PATH) and
+            os.path.getmtime(MODEL_PATH) >= os.path.getmtime(TRAINING_PATH)):
+        # a saved model we can't read, or that another version of sklearn
+        # saved (it can fail to load, or load wrong), just gets fit again
+        try:
+            with open(MODEL_PATH, 'rb') as f:
+                saved = pickle.load(f)
+            if saved['sklearn'] == sklearn.__version__:
+                _model = saved['model']
+        except Exception:
+            _model = None
+
+    if _model is None:
+        df = pd.read_csv(TRAINING_PATH)
+
+        x = df[['green', 'blue']].values
+        y = df['party'].values
+
+        # set linear SVC
+        _model = SVC(kernel='linear').fit(x, y)
+
+        # saving is just a speedup, so don't fail if we can't write. Write
+        # to a temp file first, so other processes loading the model at
+        # the same time never see it half written
+        temp_path = '%s.%s.tmp' % (MODEL_PATH, os.getpid())
+        try:
+            with open(temp_path, 'wb') as f:
+                pickle.dump({'sklearn': sklearn.__version__,
+                             'model': _model}, f)
+            os.replace(temp_path, MODEL_PATH)
+        except OSError:
+            pass
 
-    df = pd.read_csv('rgb_party.csv')
-    
-    x = df[['green', 'blue']]
-    y = df['party']
-    
-    # set linear SVC
-    model = SVC(kernel='linear').fit(x, y)
-    
-    party = model.predict(rgb[['green', 'blue']])
-    
-    return party
+    return _model
+
+
+def predict_parties(green_blue):
+    '''
+    Classify many colors at once.
+
+    Takes an (n, 2) array of (green, blue) values, e.g. every heat-map color
+    on a page, and returns an array of n party names. Only colors that
+    haven't been seen before are sent through the model.
+
+    '''
+
+    green_blue = np.asarray(green_blue, dtype=int).reshape(-1, 2)
+
+    if len(green_blue) == 0:
+        return np.array([], dtype=object)
+
+    model = get_model()
+
+    # classify each new color once
+    unique, inverse = np.unique(green_blue, axis=0, return_inverse=True)
+    keys = list(map(tuple, unique.tolist()))
+    new = [k for k in keys if k not in _party_lookup]
+    if new:
+        _party_lookup.update(zip(new, model.predict(np.array(new))))
+
+    parties = np.array([_party_lookup[k] for k in keys], dtype=object)
+
+    return parties[inverse.ravel()]
+
+
+def predict_party(rgb):
+    '''
+    Classify a DataFrame of colors with 'green' and 'blue' columns.
 
+    '''
 
+    return predict_parties(rgb[['green', 'blue']].values)
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+'''
+Clean up the .csv's downloaded from predictit (or fetched over HTTP in the
+same shape), a whole column at a time instead of a row at a time.
+
+'''
+
+PRICE_COLUMNS = [
+    'OpenSharePrice',
+    'HighSharePrice',
+    'LowSharePrice',
+    'CloseSharePrice'
+    ]
+
+
+def cleanup_predictit(market):
+    '''
+    Clean up .csv downloaded from predictit.
+
+        - convert 'Date' column to a date
+        - convert 'CloseSharePrice' to a float price w/o the dollar sign
+        - drop unneccesary price columns
+        - rename resulting columns
+
+    '''
+
+    # convert date column to dates (the time of day doesn't matter)
+    market_date = pd.to_datetime(market['Date'].str.split(' ').str[0],
+                                 format='%m/%d/%Y')
+
+    # remove dollar sign from price column
+    price = market['CloseSharePrice']
+    if not pd.api.types.is_numeric_dtype(price):
+        price = price.astype(str).str.replace('$', '', regex=False)
+
+    market = market.drop(columns=PRICE_COLUMNS + ['Date'])
+
+    market = market.rename(columns={'ContractName': 'contract',
+                                    'TradeVolume': 'volume'
+                                    })
+
+    market['market_date'] = market_date
+    market['price'] = pd.to_numeric(price).astype(float)
+
+    return market
+
+
+def cleanup_markets(markets, info=None):
+    '''
+    Clean up many downloaded markets at once and return them as one frame.
+
+    `info` is an optional DataFrame with a row for each market (in the same
+    order as `markets`) whose columns get added to all of that market's
+    rows, e.g. election, state, and district.
+
+    '''
+
+    markets = list(markets)
+
+    if len(markets) == 0:
+        return pd.DataFrame(columns=['contract', 'volume',
+                                     'market_date', 'price'])
+
+    market = cleanup_predictit(pd.concat(markets, axis=0, ignore_index=True))
+
+    if info is not None:
+        rows = np.repeat(np.arange(len(markets)),
+                         [len(m) for m in markets])
+        info = info.iloc[rows].reset_index(drop=True)
+        for col in info.columns:
+            market[col] = info[col].values
+
+    return market
@@ -0,0 +1,157 @@
+import re
+
+import pandas as pd
+import requests
+
+from datetime import datetime
+from requests.adapters import HTTPAdapter
+
+'''
+Get a Predictit.com market's contract price and volume history over plain
+HTTP, without opening a browser. The result has the same columns as the .csv
+the "download" button gives you, so it goes through `cleanup_predictit` just
+like a downloaded market.
+
+How the request gets sent is up to the transport: anything with a
+`get_json(url, params)` method works, so the client can be pointed at a
+local stub server (`base_url`) or handed a fake transport.
+
+'''
+
+BASE_URL = 'https://www.predictit.org'
+CHART_PATH = '/api/Public/GetMarketChartData/%s'
+
+# chart api timespan (and whether it's in hours) for each date range
+TIMESPANS = {
+    '24hr': ('24', 'true'),
+    '7d': ('7d', 'false'),
+    '30d': ('30d', 'false'),
+    '90d': ('90d', 'false')
+    }
+
+# the downloaded .csv's columns, and the chart api fields they come from
+CSV_COLUMNS = {
+    'ContractName': 'contractName',
+    'Date': 'date',
+    'OpenSharePrice': 'openSharePrice',
+    'HighSharePrice': 'highSharePrice',
+    'LowSharePrice': 'lowSharePrice',
+    'CloseSharePrice': 'closeSharePrice',
+    'TradeVolume': 'tradeVolume'
+    }
+
+
+class SessionTransport:
+    '''
+    Send GET requests over one pooled, keep-alive requests session.
+
+    '''
+
+    def __init__(self, pool_size=8, timeout=10, retries=2):
+        self.timeout = timeout
+        self.session = requests.Session()
+
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size,
+                              max_retries=retries)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get_json(self, url, params=None):
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+
+        return response.json()
+
+    def close(self):
+        self.session.close()
+
+
+class MarketHistoryClient:
+    '''
+    Fetch market history from predictit's chart api.
+
+        client = MarketHistoryClient()
+        market = client.fetch(url, '30d')
+
+    '''
+
+    def __init__(self, transport=None, base_url=BASE_URL, max_contracts=6):
+        if transport is None:
+            transport = SessionTransport()
+
+        self.transport = transport
+        self.base_url = base_url.rstrip('/')
+        self.max_contracts = max_contracts
+
+    def fetch(self, url, date_range):
+        '''
+        Return a market's history for `date_range` as a DataFrame shaped
+        like the downloaded .csv, or 'no_market' if there isn't any, or the
+        url or the response isn't what we expect (like the browser does, so
+        one bad market doesn't stop the rest).
+
+        '''
+
+        timespan, in_hours = TIMESPANS[date_range]
+        params = {
+            'timespan': timespan,
+            'maxContracts': self.max_contracts,
+            'isTimespanInHours': in_hours
+            }
+
+        try:
+            history = self.transport.get_json(
+                self.base_url + CHART_PATH % market_id(url), params
+                )
+            if not history:
+                return 'no_market'
+
+            return to_download_csv(history)
+
+        except (requests.RequestException, ValueError, KeyError,
+                TypeError) as error:
+            print('no market history for %s: %r' % (url, error))
+            return 'no_market'
+
+    def close(self):
+        self.transport.close()
+
+
+def market_id(url):
+    '''
+    Pull the market's number out of its url, e.g. 5808 from
+    https://www.predictit.org/markets/detail/5808/Which-party-will-win...
+
+    '''
+
+    found = re.search(r'/markets/detail/(\d+)', url)
+    if found is None:
+        raise ValueError('no market id in %s' % url)
+
+    return found.group(1)
+
+
+def to_download_csv(history):
+    '''
+    Turn the chart api's records into the downloaded .csv's columns:
+        - api field names to .csv column names
+        - iso dates to the .csv's date format
+        - prices to dollar strings
+
+    '''
+
+    market = pd.DataFrame(history)
+    market = market[list(CSV_COLUMNS.values())]
+    market.columns = list(CSV_COLUMNS.keys())
+
+    market['Date'] = [
+        datetime.fromisoformat(day[:19]).strftime('%m/%d/%Y %I:%M:%S %p')
+        for day in market['Date']
+        ]
+
+    for col in ['OpenSharePrice', 'HighSharePrice', 'LowSharePrice',
+                'CloseSharePrice']:
+        market[col] = ['$%.2f' % price for price in market[col]]
+
+    return market
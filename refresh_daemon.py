@@ -0,0 +1,264 @@
+import os
+import queue
+import socket
+import socketserver
+import threading
+
+'''
+Keep one process running and refresh on demand, instead of starting from
+scratch every time. Whatever's slow to start (browsers, R, the party
+classifier, worker processes) gets loaded once and stays loaded, so a
+refresh only pays for the work itself.
+
+Refreshes get asked for on a schedule (every `interval` seconds) or over a
+local socket, one line per request:
+
+    run                         # the whole pipeline
+    run --force                 # the whole pipeline, up to date or not
+    run modeling                # just some stages
+    status                      # what's up to date
+    stop                        # finish the current run and exit
+
+Runs happen one at a time, in the order they were asked for, and asking
+for a run that's already waiting to start just waits on that one. The
+socket answers once the run is done.
+
+    send('run modeling')        # from another process
+
+'''
+
+SOCKET_PATH = 'daily_execute.sock'
+
+
+class Request:
+    '''
+    A run someone asked for, and how it went once it's done.
+
+    '''
+
+    def __init__(self, only=None, force=False):
+        self.only = only
+        self.force = force
+        self.done = threading.Event()
+        self.result = None
+
+    def same(self, other):
+        return (self.only == other.only) and (self.force == other.force)
+
+
+class Daemon:
+    '''
+    Runs `run(only, force)` for every request, and answers `status` with
+    `status()`. `serve` takes a `warm_up` to load everything up front.
+
+        daemon = Daemon(run, status, interval=15 * 60)
+        daemon.serve(warm_up)
+
+    '''
+
+    def __init__(self, run, status=None, interval=None, path=SOCKET_PATH):
+        self.run = run
+        self.status = status
+        self.interval = interval
+        self.path = path
+
+        self._requests = queue.Queue()
+        self._waiting = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def request(self, only=None, force=False):
+        '''
+        Ask for a run, and return the request to wait on. If the same run
+        is already waiting to start, return that one instead.
+
+        '''
+
+        new = Request(only, force)
+
+        with self._lock:
+            for waiting in self._waiting:
+                if waiting.same(new):
+                    return waiting
+            self._waiting.append(new)
+
+        self._requests.put(new)
+
+        return new
+
+    def stop(self):
+        '''
+        Stop after the current run.
+
+        '''
+
+        self._stopped.set()
+        self._requests.put(None)
+
+    def serve(self, warm_up=None):
+        '''
+        Load everything with `warm_up`, then take requests from the schedule
+        and the socket until stopped, running them one at a time. Raises
+        RuntimeError if another daemon is already answering on the socket.
+
+        '''
+
+        # check before loading anything, and before taking over its socket
+        if running(self.path):
+            raise RuntimeError('a daemon is already running on %s' %
+                               self.path)
+
+        if warm_up is not None:
+            warm_up()
+
+        server = self._listen()
+        threads = [threading.Thread(target=server.serve_forever, daemon=True)]
+        if self.interval:
+            threads.append(threading.Thread(target=self._schedule,
+                                            daemon=True))
+        for thread in threads:
+            thread.start()
+
+        print('listening on %s' % self.path)
+
+        try:
+            while not self._stopped.is_set():
+                request = self._requests.get()
+                if request is None:
+                    continue
+
+                with self._lock:
+                    self._waiting.remove(request)
+
+                self._handle(request)
+
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            # don't leave anyone waiting on a run that won't happen
+            with self._lock:
+                for request in self._waiting:
+                    request.result = 'stopped before it ran'
+                    request.done.set()
+
+            server.shutdown()
+            server.server_close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def _handle(self, request):
+        '''
+        Run a request, and keep the daemon going even if the run fails.
+
+        '''
+
+        try:
+            ran = self.run(request.only, request.force)
+            request.result = 'ok, ran %s' % (', '.join(ran) or 'nothing')
+        except Exception as error:
+            print('refresh failed: %r' % error)
+            request.result = 'failed: %r' % error
+        finally:
+            request.done.set()
+
+    def _schedule(self):
+        '''
+        Ask for a full refresh every `interval` seconds.
+
+        '''
+
+        while not self._stopped.wait(self.interval):
+            self.request(force=True)
+
+    def _listen(self):
+        '''
+        Start listening on the socket, clearing out one left behind by a
+        daemon that didn't shut down cleanly (`serve` already checked that
+        nothing answers on it).
+
+        '''
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                line = self.rfile.readline().decode().strip()
+
+                # just checking that we're running
+                if line == '':
+                    return
+
+                reply = daemon._answer(line)
+                self.wfile.write((reply + '\n').encode())
+
+        server = socketserver.ThreadingUnixStreamServer(self.path, Handler)
+        server.daemon_threads = True
+
+        return server
+
+    def _answer(self, line):
+        '''
+        Act on one line from the socket and return the reply.
+
+        '''
+
+        words = line.split()
+        command, words = (words[0], words[1:]) if words else ('', [])
+
+        if command == 'run':
+            force = '--force' in words
+            only = [word for word in words if word != '--force'] or None
+
+            request = self.request(only, force)
+            request.done.wait()
+
+            return request.result
+
+        if (command == 'status') and (self.status is not None):
+            return str(self.status())
+
+        if command == 'stop':
+            self.stop()
+            return 'stopping'
+
+        return 'unknown request %r' % line
+
+
+def running(path=SOCKET_PATH):
+    '''
+    Return whether a daemon is answering on the socket at `path`.
+
+    '''
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(path)
+        except OSError:
+            return False
+
+    return True
+
+
+def send(line, path=SOCKET_PATH):
+    '''
+    Send one request to a running daemon and return its reply, once the
+    run it asked for is done.
+
+    '''
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        connection.sendall((line + '\n').encode())
+
+        reply = b''
+        while not reply.endswith(b'\n'):
+            chunk = connection.recv(4096)
+            if not chunk:
+                break
+            reply += chunk
+
+    return reply.decode().strip()
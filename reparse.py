@@ -0,0 +1,39 @@
+import sys
+
+import scrape_538
+import scrape_economist_statewide_margins
+import scrape_predictit_all
+
+'''
+Rebuild the polling, market, and Economist .csv's from the pages and
+downloads saved in the page cache, without opening a browser or fetching
+anything. Handy after changing how any of them get parsed or cleaned.
+
+    python reparse.py                      # everything
+    python reparse.py 538 predictit        # just some of them
+
+'''
+
+SOURCES = ['538', 'predictit', 'economist']
+
+
+def main(sources=SOURCES):
+    '''
+    Re-parse each of `sources` from the page cache.
+
+    '''
+
+    if '538' in sources:
+        scrape_538.run(processes=scrape_538.MAX_PROCESSES, backend='cache')
+
+    if 'predictit' in sources:
+        # the history store already has the cached days, so just add them
+        scrape_predictit_all.main(backend='cache',
+                                  incremental=scrape_predictit_all.incremental)
+
+    if 'economist' in sources:
+        scrape_economist_statewide_margins.main(reparse=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or SOURCES)
@@ -1,39 +1,304 @@
 import predict_party
+import driver_pool
+import columnar_store
+import html_extract
+import page_cache
+import polls_feed
+import waits
 
 import pandas as pd
 import numpy as np
+import multiprocessing
 import re
 import unidecode
 
 from time import sleep
 from bs4 import BeautifulSoup
-from selenium import webdriver
 from selenium import common
 from datetime import datetime
+from multiprocessing import util
 from webdriver_manager.chrome import ChromeDriverManager
-from PIL import ImageColor
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
+# most browsers to scrape with at once in parallel mode
+MAX_PROCESSES = 4
 
-def main(state, election):
+# start worker processes fresh instead of forking them, since other
+# threads (e.g. the pipeline's other stages) may be holding locks that a
+# forked copy would inherit held
+SPAWN = multiprocessing.get_context('spawn')
+
+# how to parse the polls on a page
+PARSER = 'lxml'  # ['lxml', 'bs4']
+
+
+def run(processes=1, elections=('senate', 'house'), backend='dom',
+        sources=None, warm=False):
+    '''
+    Scrape all of 538's senate and house polling: one page per chamber, or
+    with more than one process, one page per (chamber, state).
+
+    With backend='feed', read 538's polls data instead of the pages (from
+    538, or from the files in `sources`, e.g. {'senate': 'senate.csv'}).
+    With backend='cache', re-parse the pages saved by the last scrape
+    without opening a browser, whether it scraped each state's page or
+    each chamber's whole page.
+
+    With `warm`, keep the worker processes (and their browsers) running
+    for the next scrape.
+
+    '''
+
+    parallel = (processes > 1) and (backend != 'feed')
+    if parallel or (backend == 'cache'):
+        main_parallel(elections, processes, backend, warm)
+    else:
+        for election in elections:
+            source = (sources or {}).get(election)
+            main('', election, backend, source)
+
+
+def main(state, election, backend='dom', source=None):
     '''
     Scrape 538 for all polling. If a state doesn't have any polling in
     2020, just ignore it.
 
     '''
 
-    polls, first_year = get_state_polling(state, election)
+    results = scrape_polls(state, election, backend, source)
 
     # if there's no relevant polling, stop
-    if (first_year != 2020) | (polls == 'stop'):
+    if results is None:
         print('No relevant polling for this state!')
 
-    # otherwise, extract information
     else:
-        final_results = pd.DataFrame()
-        for n in range(len(polls)):
-            day_results = extract_polling(polls[n])
+        save_polls(results, '%s_%s_polling.csv' % (state, election))
+        print('Successfully scraped %s!' % state)
+
+
+def main_parallel(elections=('senate', 'house'), processes=MAX_PROCESSES,
+                  backend='dom', warm=False):
+    '''
+    Scrape every (chamber, state) page in a pool of processes, each with
+    its own browser, and save each chamber's polls to the same file a
+    single-page scrape would.
+
+    '''
+
+    if backend == 'cache':
+        units = cached_units(elections)
+    else:
+        # slugs for each state's page, e.g. 'new-hampshire'
+        states = [s.replace(' ', '-') for s in states_dict_house().values()]
+        units = [(state, election, backend)
+                 for election in elections for state in states]
+
+    processes = max(1, min(processes, MAX_PROCESSES))
+    if warm:
+        try:
+            results = list(warm_executor(processes).map(scrape_unit, units))
+        except BrokenProcessPool:
+            # a worker died (e.g. chrome ran out of memory), so start over
+            # with new ones
+            close_warm_executor()
+            results = list(warm_executor(processes).map(scrape_unit, units))
+    else:
+        with ProcessPoolExecutor(max_workers=processes,
+                                 mp_context=SPAWN,
+                                 initializer=start_worker) as executor:
+            results = list(executor.map(scrape_unit, units))
+
+    # merge in the same order every time
+    for election in elections:
+        found = [r for (state, elec, _), r in zip(units, results)
+                 if (elec == election) and (r is not None)]
+
+        if len(found) == 0:
+            print('No relevant %s polling!' % election)
+            continue
+
+        merged = pd.concat(found, axis=0).drop_duplicates(keep='first')
+        merged = merged.reset_index(drop=True)
+
+        save_polls(merged, '_%s_polling.csv' % election)
+        print('Successfully scraped %s polling!' % election)
+
+
+def cached_units(elections):
+    '''
+    Return a (state, chamber, 'cache') unit for each page of 538 polling
+    in the page cache: every state's page from a scrape in processes, or
+    the chamber's whole page (state '') from a one page scrape, whichever
+    was saved last.
+
+    '''
+
+    cache = page_cache.default_cache()
+    keys = [key.split('/', 1) for key in cache.keys('538')]
+
+    units = []
+    for election in elections:
+        fetched = {state: cache.fetched_at('538', election + '/' + state)
+                   for elec, state in keys if elec == election}
+
+        states = [state for state in fetched if state != '']
+        whole = fetched.get('')
+        if (whole is not None) and all(fetched[s] < whole for s in states):
+            states = ['']
+
+        units += [(state, election, 'cache') for state in states]
+
+    return units
+
+
+# worker processes a long-lived process keeps between scrapes
+_executor = None
+
+
+def warm_executor(processes=MAX_PROCESSES):
+    '''
+    Return the pool of worker processes kept between scrapes, starting it
+    the first time (or again, if a worker died and broke it) with the
+    party classifier loaded in each worker. Each worker's browser stays
+    open in between, too.
+
+    Workers only start once there's work for them, so give each one a
+    no-op right away to have them all loaded before the first scrape.
+
+    '''
+
+    global _executor
+
+    if (_executor is not None) and _executor._broken:
+        close_warm_executor()
+
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=processes,
+                                        mp_context=SPAWN,
+                                        initializer=start_worker)
+        list(_executor.map(worker_ready, range(processes)))
+
+    return _executor
+
+
+def close_warm_executor():
+    '''
+    Shut down the warm worker processes, which quits their browsers.
+
+    '''
+
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+def start_worker():
+    '''
+    Get a worker process ready: load the party classifier, and quit the
+    worker's browser when the worker exits, since `atexit` doesn't run in
+    pool workers and the chrome would be left running.
+
+    '''
+
+    predict_party.get_model()
+    util.Finalize(None, driver_pool.close_default_pool, exitpriority=10)
+
+
+def worker_ready(_):
+    '''
+    Nothing, to get a worker process started.
+
+    '''
+
+    return None
+
+
+def scrape_unit(unit):
+    '''
+    Scrape one (state, chamber) page in a worker process. 538 numbers
+    polls within a page, so add the state to poll IDs to keep them unique
+    across pages.
+
+    A page that fails (a timeout, a missing element) only loses that
+    state, like it would scraping one page at a time.
+
+    '''
+
+    state, election, backend = unit
+    try:
+        results = scrape_polls(state, election, backend)
+    except Exception as error:
+        print('Failed to scrape %s %s polling: %r' % (state, election,
+                                                      error))
+        return None
+
+    if (results is not None) and (state != ''):
+        results['poll_id'] = results['poll_id'] + '-' + state
+
+    return results
+
+
+def save_polls(results, docname):
+    '''
+    Save polls to csv, plus a columnar copy if we're using one.
+
+    '''
+
+    # house districts come off the page as strings, senate ones as 0, so
+    # make them all numbers like the markets' before saving either chamber
+    results = results.assign(district=results['district'].astype(int))
+
+    results.to_csv(docname, index=False)
+
+    if columnar_store.enabled():
+        columnar_store.write_dataset(results, 'polls')
+
+
+def scrape_polls(state, election, backend='dom', source=None,
+                 parser=PARSER):
+    '''
+    Scrape and clean up 538's polling for one page. Returns None if there's
+    no 2020 polling on it.
+
+    backend='feed' gets the same polls from 538's polls data (or the file
+    `source`) instead of the page, and backend='cache' re-parses the last
+    copy of the page we saved. `parser` picks how the page gets parsed
+    (see `parse_polls`).
+
+    '''
+
+    if backend == 'feed':
+        results = polls_feed.load_polls(election, source, state)
+        if len(results) == 0:
+            return None
+        return results
+
+    if backend == 'cache':
+        polls = cached_state_polling(state, election)
+    else:
+        polls = get_state_polling(state, election)
+
+        # save the polls' html so we can re-parse them without scraping
+        if type(polls) != str:
+            polls = ''.join(polls)
+            page_cache.default_cache().put(
+                '538', election + '/' + state, polls
+                )
 
-            final_results = pd.concat([final_results, day_results], axis=0)
+    # build the frame once from every poll on the page
+    if polls != 'stop':
+        final_results = parse_polls(polls, parser)
+
+    # if there's no relevant (most recently 2020) polling, stop
+    if ((polls == 'stop') or (len(final_results) == 0) or
+            (final_results['poll_date'][0][:4] != '2020')):
+        return None
+
+    # otherwise, clean up the polls
+    else:
 
         # sometimes web scraping duplicates polls, not sure why
         results = final_results.drop_duplicates(keep='first')
@@ -75,10 +340,7 @@ def main(state, election):
             'net_polling'
             ]]
 
-        # save to csv
-        docname = '%s_%s_polling.csv' % (state, election)
-        results.to_csv(docname, index=False)
-        print('Successfully scraped %s!' % state)
+        return results
 
 
 def get_state_polling(state, election):
@@ -91,44 +353,83 @@ def get_state_polling(state, election):
     # Set base url
     base_url = 'https://projects.fivethirtyeight.com/polls/'
 
-    # open up chrome
-    driver = webdriver.Chrome(
-        executable_path=
-        '/Users/JonahKrop/Documents/Projects/predictit/chromedriver'
-        )
-    driver.get(base_url + election + '/' + state)
+    url = base_url + election + '/' + state
+
+    # borrow a warm chrome from the pool
+    with driver_pool.default_pool().driver() as driver:
+        polls = show_all_polls(driver, url)
+
+    return polls
+
+
+def cached_state_polling(state, election):
+    '''
+    Load the polls' html saved from the last scrape of a page, or 'stop' if
+    there isn't any.
+
+    '''
+
+    html = page_cache.default_cache().latest('538', election + '/' + state)
+
+    if (html is None) or (len(html) == 0):
+        return 'stop'
+
+    return html.decode('utf-8')
+
+
+def parse_polls(html, parser=PARSER):
+    '''
+    Return a DataFrame of RESULT_COLUMNS for every poll in the day
+    containers in `html`, parsed with lxml (`html_extract`) or
+    BeautifulSoup (`stream_polls`).
 
+    '''
+
+    if parser == 'lxml':
+        records = fast_polls(html)
+    else:
+        polls = BeautifulSoup(html, 'lxml').find_all(
+            'div', {'class': 'day-container'}
+            )
+        records = stream_polls(polls)
+
+    return pd.DataFrame(records, columns=RESULT_COLUMNS)
+
+
+def show_all_polls(driver, url):
+    '''
+    Load a 538 polling page and keep showing more polls until we're back
+    through July, 2020. Returns the html of each day container, or 'stop'
+    if the page has no polls (e.g. the state isn't available).
+
+    '''
+
+    driver.get(url)
+
+    polls, dates = [], []
     stop = 0
     while stop == 0:
 
         '''
-        Extract html. If the last poll shown is more recent than July, request
-        to show more polls. Continue requesting more polls until we get
-        through July.
+        Grab the html of each poll container we haven't seen yet. If the last
+        poll shown is more recent than July, request to show more polls.
+        Continue requesting more polls until we get through July. Nothing
+        gets parsed here; the browser hands over each container's html
+        and date, and all of them get parsed together afterwards.
         '''
 
-        # extract soup
-        soup = BeautifulSoup(driver.page_source, 'lxml')
+        for html, date in new_day_containers(driver, len(polls)):
+            polls.append(html)
+            dates.append(date)
 
         # if state isn't available, return stuff
-        if soup.text == '404 Not Found':
+        if len(polls) == 0:
             polls = 'stop'
-            recent = 'your state doesnt matter'
             stop = 1
 
         else:
-            # get html for each poll on the page
-            polls = soup.find_all('div', {'class': 'day-container'})
-
-            # get most recent poll year
-            recent = polls[0].find_all('h2',
-                                       {'class': 'day'})[0].attrs['data-date']
-            recent = datetime.strptime(recent, '%Y-%m-%d').year
-
             # get last poll date
-            last = polls[-1].find_all('h2',
-                                      {'class': 'day'})[0].attrs['data-date']
-            last = datetime.strptime(last, '%Y-%m-%d').date()
+            last = datetime.strptime(dates[-1], '%Y-%m-%d').date()
 
             # if last poll was before July 2020, stop
             # otherwise show more, unless there's none to show
@@ -140,24 +441,160 @@ def get_state_polling(state, election):
                 except common.exceptions.ElementNotInteractableException:
                     print('all polls visible')
                     stop = 1
+                else:
+                    # let the new polls show up before parsing them
+                    try:
+                        waits.wait_for(driver, waits.more_elements(
+                            'day-container', len(polls)
+                            ))
+                    except waits.TimeoutException:
+                        pass
+
+    return polls
+
+
+def new_day_containers(driver, seen):
+    '''
+    Return the html and date of the day containers added to the page after
+    the first `seen` of them, rather than the whole page.
+
+    '''
+
+    # grab just the new containers from the browser
+    script = '''
+        return Array.from(document.querySelectorAll('div.day-container'))
+            .slice(arguments[0])
+            .map(function (e) {
+                var day = e.querySelector('h2.day');
+                return [e.outerHTML, day && day.getAttribute('data-date')];
+            });
+        '''
 
-    driver.close()
+    return driver.execute_script(script, seen)
 
-    return polls, recent
 
+RESULT_COLUMNS = [
+    'poll_id',
+    'election',
+    'state',
+    'poll_date',
+    'pollster',
+    'sponsored',
+    'pollster_grade',
+    'poll_sample',
+    'voter_type',
+    'candidate',
+    'party',
+    'polling',
+    'net_polling'
+    ]
 
-def extract_polling(poll_day):
+
+def fast_polls(html):
+    '''
+    Yield the same records as `stream_polls`, reading the polls with the
+    precompiled selectors in `html_extract` instead of BeautifulSoup.
+
+    '''
+
+    days = list(html_extract.iter_days(html))
+
+    # classify every candidate's color on the page in one go
+    styles = [style for day in days for row in day['rows']
+              for style in row['styles']]
+    party = predict_party.predict_parties(hex_to_rgb(styles)[:, 1:])
+
+    # send each party back to its poll, in candidate order
+    k = 0
+    for day in days:
+        for row in day['rows']:
+            row['party'] = party[k:k + len(row['styles'])]
+            k += len(row['styles'])
+
+    for day in days:
+        for j, row in enumerate(day['rows']):
+
+            # 538 marks sponsored polls with an '*'
+            pollster_name = row['pollster']
+            sponsored = int(pollster_name[-1] == '*')
+            if sponsored:
+                pollster_name = pollster_name[:-1]
+
+            grade = row['pollster_grade']
+            if grade is None:
+                grade = np.nan
+
+            sample, voter = row['poll_info'].split(', ')[-1].split(' ')[:2]
+
+            poll_result = row['answers'].split('%')[:-1]
+            candidate, polling = candidate_polling(poll_result)
+
+            poll_id = str(day['poll_date']) + '-' + str(day['election'])
+            poll_id += '-%s' % j
+
+            for c in range(len(candidate)):
+                yield {
+                    'poll_id': poll_id,
+                    'election': day['election'],
+                    'state': row['state'].strip(' '),
+                    'poll_date': day['poll_date'],
+                    'pollster': pollster_name,
+                    'sponsored': sponsored,
+                    'pollster_grade': grade,
+                    'poll_sample': int(sample.replace(',', '')),
+                    'voter_type': voter,
+                    'candidate': candidate[c],
+                    'party': row['party'][c],
+                    'polling': polling[c],
+                    'net_polling': int(row['net'])
+                    }
+
+
+def stream_polls(polls, parties=None):
+    '''
+    Yield a record (dict of RESULT_COLUMNS) for every candidate in every
+    poll on the page, as each poll is parsed. Lets you handle polls one at
+    a time instead of holding the whole page's results in a DataFrame.
+
+    '''
+
+    # classify every candidate's color on the page in one go
+    if parties is None:
+        parties = page_parties(polls)
+
+    for n in range(len(polls)):
+        yield from iter_polling(polls[n], parties[n])
+
+
+def extract_polling(poll_day, parties=None):
+    '''
+    Return a DataFrame of the records `iter_polling` finds for a day.
+
+    '''
+
+    return pd.DataFrame(iter_polling(poll_day, parties),
+                        columns=RESULT_COLUMNS)
+
+
+def iter_polling(poll_day, parties=None):
     '''
     538 groups polls by day, so it's possible to have multiple polls in one
-    entry. Function takes the poll(s) of a given day and extracts:
+    entry. Function takes the poll(s) of a given day and yields a record
+    for each candidate with:
         - the published day the poll(s)
         - the pollster name(s) for the poll(s)
         - 538's pollster grade(s)
         - sample size and consituency for the poll(s)
         - results of the poll(s)
 
+    Candidate parties come from `page_parties`; pass them in if they've
+    already been classified for the whole page.
+
     '''
 
+    if parties is None:
+        parties = page_parties([poll_day])[0]
+
     # extract publish date
     poll_date = poll_day.find_all('h2', {'class': 'day'})[0].attrs['data-date']
 
@@ -174,25 +611,6 @@ def extract_polling(poll_day):
     # save all polling results
     poll_results = poll_day.find_all('tr', {'class': 'visible-row'})
 
-    result_columns = [
-        'poll_id',
-        'election',
-        'state',
-        'poll_date',
-        'pollster',
-        'sponsored',
-        'pollster_grade',
-        'poll_sample',
-        'voter_type',
-        'candidate',
-        'party',
-        'polling',
-        'net_polling'
-        ]
-
-    # initialize df to update with each poll
-    day_results = pd.DataFrame(columns=result_columns)
-
     for j in range(len(poll_results)):
         '''
         Loop through each poll on the given day. For each poll, extract:
@@ -263,36 +681,29 @@ def extract_polling(poll_day):
         # drop '+'
         net = int(net)
 
-        # extract poll coloring to determine party affiliation
-        poll_party = poll_results[j].find_all(
-            'td', {'class': 'answers hide-desktop'}
-            )
-        party = hex_to_color(poll_party)
+        # party affiliation was determined from the poll coloring
+        party = parties[j]
 
         # give a poll ID comprised of date + number
         poll_id = str(poll_date) + '-' + str(elec) + '-%s' % j
 
-        # initialize df for storing data for a loop
-        temp_results = pd.DataFrame(columns=result_columns)
-
-        temp_results['candidate'] = candidate
-        temp_results['polling'] = polling
-        temp_results['net_polling'] = net
-        temp_results['poll_date'] = poll_date
-        temp_results['pollster'] = pollster_name
-        temp_results['sponsored'] = sponsored
-        temp_results['pollster_grade'] = pollster_grade
-        temp_results['poll_sample'] = int(sample.replace(',', ''))
-        temp_results['voter_type'] = voter
-        temp_results['party'] = party
-        temp_results['election'] = elec
-        temp_results['state'] = state
-        temp_results['poll_id'] = poll_id
-
-        # add into the day's results
-        day_results = pd.concat([day_results, temp_results], axis=0)
-
-    return day_results
+        # one record per candidate in the poll
+        for c in range(len(candidate)):
+            yield {
+                'poll_id': poll_id,
+                'election': elec,
+                'state': state,
+                'poll_date': poll_date,
+                'pollster': pollster_name,
+                'sponsored': sponsored,
+                'pollster_grade': pollster_grade,
+                'poll_sample': int(sample.replace(',', '')),
+                'voter_type': voter,
+                'candidate': candidate[c],
+                'party': party[c],
+                'polling': polling[c],
+                'net_polling': net
+                }
 
 
 def candidate_polling(poll_result):
@@ -319,36 +730,91 @@ def candidate_polling(poll_result):
     return candidate, polling
 
 
-def hex_to_color(poll_party):
+def page_parties(polls):
+    '''
+    Determine every candidate's political affiliation on the page from the
+    poll coloring, all at once:
+        - gather the heat-map color of each candidate in every poll
+        - convert all the hex colors to RGB together
+        - classify all the colors together (Rep. has highest red value,
+          Dem. has highest blue value, Ind. has highest green value)
+
+    Returns a list (one per day) of lists (one per poll) of parties.
+
+    '''
+
+    styles, owners = [], []
+    parties = []
+    for n in range(len(polls)):
+
+        poll_results = polls[n].find_all('tr', {'class': 'visible-row'})
+        parties.append([[] for j in range(len(poll_results))])
+
+        for j in range(len(poll_results)):
+
+            # filter to colormap data
+            poll_party = poll_results[j].find_all(
+                'td', {'class': 'answers hide-desktop'}
+                )
+            filt = poll_party[0].find_all('div', {'class': 'heat-map'})
+
+            for c in range(len(filt)):
+                styles.append(filt[c].attrs['style'])
+                owners.append((n, j))
+
+    rgb = hex_to_rgb(styles)
+    party = predict_party.predict_parties(rgb[:, 1:])
+
+    # send each party back to its poll, in candidate order
+    for (n, j), p in zip(owners, party):
+        parties[n][j].append(p)
+
+    return parties
+
+
+# a 3 or 6 digit hex color, without the '#'
+HEX_COLOR = re.compile(r'[0-9a-fA-F]{3}|[0-9a-fA-F]{6}')
+
+# hex digit ascii code -> value
+HEX_VALUES = np.zeros(256, dtype=np.uint8)
+HEX_VALUES[np.frombuffer(b'0123456789', np.uint8)] = np.arange(10)
+HEX_VALUES[np.frombuffer(b'abcdef', np.uint8)] = np.arange(10, 16)
+HEX_VALUES[np.frombuffer(b'ABCDEF', np.uint8)] = np.arange(10, 16)
+
+
+def hex_to_rgb(styles):
     '''
-    Extract hex color from polling data and convert to RGB to determine
-    candidate's political affiliation.
-        - Rep. has highest red value
-        - Dem. has highest blue value
-        - Ind. has highest green value
+    Convert heat-map style strings like 'background-color:#ffd2c0;' (or
+    the short '#fdc') to an (n, 3) array of RGB values. Raises ValueError
+    for anything else.
 
     '''
 
-    # filter to colormap data
-    filt = poll_party[0].find_all('div', {'class': 'heat-map'})
+    if len(styles) == 0:
+        return np.zeros((0, 3), dtype=int)
 
-    r, g, b = [], [], []
-    for c in range(len(filt)):
+    # keep the hex digits between the '#' and the ';'
+    after = np.char.partition(np.array(styles, dtype=str), '#')[:, 2]
+    hex_color = np.char.strip(np.char.partition(after, ';')[:, 0])
 
-        # extract hex color
-        hex_color = filt[c].attrs['style'].split(':')[1][:-1]
+    for style, color in zip(styles, hex_color):
+        if HEX_COLOR.fullmatch(color) is None:
+            raise ValueError('not a hex color: %r' % style)
 
-        # convert to rgb
-        rgb = ImageColor.getcolor(hex_color, 'RGB')
+    # expand short colors, e.g. '#fdc' to '#ffddcc'
+    hex_color = hex_color.astype('U6')
+    short = np.char.str_len(hex_color) == 3
+    if short.any():
+        hex_color[short] = [''.join(d * 2 for d in h)
+                            for h in hex_color[short]]
 
-        r.append(rgb[0])
-        g.append(rgb[1])
-        b.append(rgb[2])
+    hex_color = hex_color.astype('S6')
 
-    color = pd.DataFrame(zip(r, g, b), columns=['red', 'green', 'blue'])
-    color['party'] = predict_party.predict_party(color)
+    # split into digits, then combine pairs of digits into r, g, b
+    digits = HEX_VALUES[hex_color.view(np.uint8).reshape(-1, 6)]
+    rgb = digits[:, 0::2].astype(int) * 16 + digits[:, 1::2]
 
-    return list(color['party'])
+    return rgb
 
 
 def extract_text_int(string):
@@ -507,9 +973,3 @@ if __name__ == "__main__":
     state = ''
     election = 'house'
     main(state, election)
-
-# if calling from another file, run automatically
-else:
-    state = ''
-    for election in ['senate', 'house']:
-        main(state, election)
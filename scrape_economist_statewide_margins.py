@@ -1,91 +1,212 @@
 """Scrape Presidential Projected Margins for Each State from Economist.
 
 Note that we have to use selenium because the Economist made their webpage
-load dynamically. Therefore, we have to pull up the site and scroll through
-it rather than a simple urllib request. Otherwise, the html does not load
-the projected marings"""
+load dynamically. Therefore, we have to pull up the site and wait for it
+to draw rather than a simple urllib request. Otherwise, the html does not
+load the projected marings"""
+import columnar_store
+import driver_pool
+import html_extract
+import margin_store
+import page_cache
+import waits
 import pandas as pd
 import time
 from bs4 import BeautifulSoup
-from selenium import webdriver
 from datetime import datetime
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
+from selenium.webdriver.support import expected_conditions as EC
+from concurrent.futures import ThreadPoolExecutor
 
+# How to parse each state's page ('lxml' or 'bs4')
+PARSER = 'lxml'
 
-def main():
-    """Scrape."""
-    # Set base url
-    base_url = 'https://projects.economist.com/us-2020-forecast/president/'
+# How many browsers to pull states with at once
+MAX_BROWSERS = 4
+
+# The two candidates' projected margins, once they've drawn, and Biden's
+# (told apart by his blue), the same nodes `parse_page` reads
+MARGINS = 'g.g-text'
+BIDEN_MARGIN = 'g.g-text[fill="#2e3c85"], g.g-text [fill="#2e3c85"]'
 
+
+def main(reparse=False, browsers=MAX_BROWSERS, warm=False):
+    """Scrape, or re-parse the pages saved last time with `reparse`.
+
+    With `warm`, keep the browsers open for the next scrape.
+    """
     # Pulls states dict
     states = states_dict()
 
+    # Get each state's page, from the site or the page cache
+    if reparse:
+        pages, pulled = cached_pages(states)
+    else:
+        pages = fetch_pages(states, browsers, warm)
+        pulled = datetime.today()
+
     # Initialize dataframe we'll ave
     df = pd.DataFrame(columns=['state', 'biden', 'trump', 'state_full'])
 
-    # Open up chrome
-    driver = webdriver.Chrome()
-
     # Pull margin for each state
     for state, state_full in states.items():
-        # Display progress
-        print(state)
-
-        # Use selenium to pull up the web page
-        driver.get(base_url + state_full)
-
-        # Random stack overflow code to scroll through website
-        heights = []
-        script_text = 'return document.body.scrollHeight'
-        for i in range(1, 500):
-            bg = driver.find_element_by_css_selector('body')
-            time.sleep(0.1)
-            bg.send_keys(Keys.END)
-            heights.append(driver.execute_script(script_text))
-            try:
-                bottom = heights[i - 16]
-            except:
-                pass
-            if i % 16 == 0:
-                new_bottom = heights[i - 1]
-                if bottom == new_bottom:
-                    break
-
-        # Extract soup
-        soup = BeautifulSoup(driver.page_source, 'lxml')
-
-        # Get html for each candidates margin (not in particular order)
-        candidate1 = soup.findAll('g', {'class': 'g-text'})[0]
-        candidate2 = soup.findAll('g', {'class': 'g-text'})[1]
+        if state not in pages:
+            print('no page for %s' % state)
+            continue
 
-        # Get candidate support
-        support1 = float(candidate1.text.split('%')[0])
-        support2 = float(candidate2.text.split('%')[0])
+        biden, trump = parse_page(pages[state])
 
         # Add state to dataframe
         r = len(df)
         df.at[r, 'state'] = state
         df.at[r, 'state_full'] = state_full
-
-        # Determine if Biden is candidate 1 or 2 and add to dataframe
-        if 'fill="#2e3c85"' in str(candidate1):
-            df.at[r, 'biden'] = support1
-            df.at[r, 'trump'] = support2
-        else:
-            df.at[r, 'biden'] = support2
-            df.at[r, 'trump'] = support1
+        df.at[r, 'biden'] = biden
+        df.at[r, 'trump'] = trump
 
     # Add margin
     df['margin'] = df['biden'] - df['trump']
 
-    # Get today's date
-    today = datetime.today()
-    stamp = str(today.month).zfill(2) + '_' + str(today.day).zfill(2)
+    # Date it by when the pages were pulled (not today, if re-parsing)
+    stamp = str(pulled.month).zfill(2) + '_' + str(pulled.day).zfill(2)
 
     # Save to drive
     path = 'economist_projected_margins_' + stamp + '.csv'
     df.to_csv(path, index=False)
 
+    # Save a columnar copy too, if we're using one. It keeps every pull,
+    # so a re-parse would only add the same pull again
+    if columnar_store.enabled() and not reparse:
+        df['date'] = pulled.date()
+        columnar_store.write_dataset(df, 'economist_margins')
+
+    # Add the pull to the margin history & show which states moved
+    if not reparse:
+        store = margin_store.MarginStore()
+        store.append(df, pulled.date())
+        report = store.delta_report()
+        print('%s states moved since the last pull' % len(report))
+        if len(report) > 0:
+            print(report.to_string(index=False))
+
+
+def fetch_pages(states, browsers=MAX_BROWSERS, warm=False):
+    """Return each state's loaded page, a few states at a time.
+
+    Each browser takes the next state as soon as it's done with one. Pages
+    get saved to the cache, and states that never draw their margins are
+    left out. With `warm`, the browsers stay open for the next call.
+    """
+    # Borrow from the shared pool like the other scrapers, or from a
+    # process-wide one with room for `browsers`, kept open with `warm`
+    browsers = max(1, min(browsers, MAX_BROWSERS, len(states)))
+    if browsers == 1:
+        pool, keep = driver_pool.default_pool(), True
+    else:
+        pool = driver_pool.warm_pool('economist', size=browsers)
+        keep = warm
+
+    # A crashed tab or a failed load only loses that state
+    def work(state):
+        try:
+            with pool.driver() as driver:
+                return fetch_page(driver, state, states[state])
+        except WebDriverException as error:
+            print('Failed to pull %s: %r' % (state, error))
+            return None
+
+    try:
+        with ThreadPoolExecutor(max_workers=browsers) as executor:
+            found = list(executor.map(work, states))
+    finally:
+        if not keep:
+            pool.close()
+
+    return {state: page for state, page in zip(states, found)
+            if page is not None}
+
+
+def fetch_page(driver, state, state_full):
+    """Load one state's page and return it once the margins have drawn."""
+    # Set base url
+    base_url = 'https://projects.economist.com/us-2020-forecast/president/'
+
+    # Use selenium to pull up the web page
+    start = time.time()
+    driver.get(base_url + state_full)
+
+    # Wait for both margins to draw. If they haven't, they may only draw
+    # once they're scrolled to, so scroll to the bottom and wait again.
+    try:
+        waits.wait_for_all(driver, margins_drawn())
+    except waits.TimeoutException:
+        driver.find_element_by_css_selector('body').send_keys(Keys.END)
+        try:
+            waits.wait_for_all(driver, margins_drawn())
+        except waits.TimeoutException:
+            print('%s never drew its margins' % state)
+            return None
+
+    # Display progress
+    print('%s (%.1fs)' % (state, time.time() - start))
+
+    page = driver.page_source
+    page_cache.default_cache().put('economist', state, page)
+
+    return page
+
+
+def margins_drawn():
+    """Conditions for the first two margins having settled on a number,
+    and Biden's being colored in, which is everything `parse_page` reads."""
+    return [waits.stable_text(MARGINS, 2, '%'),
+            EC.presence_of_element_located((By.CSS_SELECTOR, BIDEN_MARGIN))]
+
+
+def cached_pages(states):
+    """Return the last saved page for each state we have one for, and when
+    the latest of them was pulled (now, if there aren't any)."""
+    cache = page_cache.default_cache()
+
+    pages, fetched = {}, []
+    for state in states:
+        page = cache.latest('economist', state)
+        if page is not None:
+            pages[state] = page.decode('utf-8')
+            fetched.append(cache.fetched_at('economist', state))
+
+    if len(fetched) == 0:
+        return pages, datetime.today()
+
+    return pages, datetime.fromtimestamp(max(fetched))
+
+
+def parse_page(page, parser=PARSER):
+    """Return Biden and Trump's projected support from a state's page."""
+    if parser == 'lxml':
+        # Read just the two margins, without parsing the rest of the page
+        text1, text2, biden_first = html_extract.economist_margins(page)
+    else:
+        # Extract soup
+        soup = BeautifulSoup(page, 'lxml')
+
+        # Get html for each candidates margin (not in particular order)
+        candidate1 = soup.findAll('g', {'class': 'g-text'})[0]
+        candidate2 = soup.findAll('g', {'class': 'g-text'})[1]
+        text1, text2 = candidate1.text, candidate2.text
+        biden_first = 'fill="#2e3c85"' in str(candidate1)
+
+    # Get candidate support
+    support1 = float(text1.split('%')[0])
+    support2 = float(text2.split('%')[0])
+
+    # Determine if Biden is candidate 1 or 2
+    if biden_first:
+        return support1, support2
+
+    return support2, support1
+
 
 def states_dict():
     """Return dictionary of state abbreviation mapping to Economist name."""
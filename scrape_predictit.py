@@ -1,3 +1,7 @@
+import waits
+
+from predictit_cleaning import cleanup_predictit
+
 import pandas as pd
 import numpy as np
 import re
@@ -7,10 +11,11 @@ import sys
 from bs4 import BeautifulSoup
 from selenium import webdriver
 from selenium import common
-from datetime import datetime, timedelta
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from datetime import timedelta
 from webdriver_manager.chrome import ChromeDriverManager
 from PIL import ImageColor
-from time import sleep
 
 '''
 Go to a predictit market website based on the state, election type, and
@@ -64,91 +69,60 @@ def download_market(url, date_range):
 
     '''
 
-    # open up chrome
+    # open up chrome, and quit it even if the download never shows up
     driver = webdriver.Chrome()
-    driver.get(url)
-
-    # allow page to load
-    sleep(5)
-
-    soup = BeautifulSoup(driver.page_source, 'lxml')
-
-    # grab market name
-    name = soup.find('h1').text
-
-    # determine how far back to get data
-    if date_range == '24hr':
-        driver.find_element_by_xpath("//*[contains(text(), '24hr')]").click()
-    elif date_range == '7d':
-        driver.find_element_by_xpath("//*[contains(text(), '7 Day')]").click()
-    elif date_range == '30d':
-        driver.find_element_by_xpath("//*[contains(text(), '30 Day')]").click()
-    elif date_range == '90d':
-        driver.find_element_by_xpath("//*[contains(text(), '90 Day')]").click()
-
-    # download csv
-    driver.find_element_by_class_name('charts-header__download').click()
-
-    # allow time to download
-    sleep(5)
-
-    driver.quit()
+    try:
+        driver.get(url)
+
+        # wait for the market name and chart controls to load
+        took = waits.wait_for_all(driver, [
+            EC.presence_of_element_located((By.TAG_NAME, 'h1')),
+            EC.presence_of_element_located(
+                (By.CLASS_NAME, 'charts-header__download')
+                )
+            ])
+        print('loaded market in %.1fs' % took)
+
+        soup = BeautifulSoup(driver.page_source, 'lxml')
+
+        # grab market name
+        name = soup.find('h1').text
+
+        # determine how far back to get data
+        if date_range == '24hr':
+            driver.find_element_by_xpath(
+                "//*[contains(text(), '24hr')]"
+                ).click()
+        elif date_range == '7d':
+            driver.find_element_by_xpath(
+                "//*[contains(text(), '7 Day')]"
+                ).click()
+        elif date_range == '30d':
+            driver.find_element_by_xpath(
+                "//*[contains(text(), '30 Day')]"
+                ).click()
+        elif date_range == '90d':
+            driver.find_element_by_xpath(
+                "//*[contains(text(), '90 Day')]"
+                ).click()
+
+        # download csv
+        driver.find_element_by_class_name('charts-header__download').click()
+
+        # file name can't have a '?', so it converts to '_'
+        name_list = list(name)
+        name_list[-1] = '_'
+        file_name = ''.join(name_list) + '.csv'
+
+        # wait until the download is finished before closing chrome
+        _, took = waits.wait_for_download(downloads, file_name)
+        print('downloaded market in %.1fs' % took)
+    finally:
+        driver.quit()
 
     return name
 
 
-def convert_date(day):
-    '''
-    Take 'Date' column from Predictit csv and return a datetime.
-
-    '''
-
-    day = datetime.strptime(day, '%m/%d/%Y %H:%M:%S %p').date()
-
-    return day
-
-
-def convert_price(price):
-    '''
-    Remove dollar sign from Predictit price column.
-
-    '''
-
-    price = price.split('$')[-1]
-
-    return price
-
-
-def cleanup_predictit(market):
-    '''
-    Clean up .csv downloaded from predictit.
-
-        - convert 'Date' column to datetime
-        - drop unneccesary price columns
-        - rename resulting columns
-
-    '''
-
-    # convert to date column to datetime
-    market['market_date'] = market['Date'].apply(convert_date)
-
-    # remove dollar sign from price column
-    market['price'] = market['CloseSharePrice'].apply(convert_price)
-
-    market = market.drop(columns=['OpenSharePrice',
-                                  'HighSharePrice',
-                                  'LowSharePrice',
-                                  'CloseSharePrice',
-                                  'Date'
-                                  ])
-
-    market = market.rename(columns={'ContractName': 'contract',
-                                    'TradeVolume': 'volume'
-                                    })
-
-    return market
-
-
 if __name__ == "__main__":
 
     # set download folder path
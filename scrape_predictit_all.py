@@ -1,13 +1,27 @@
+import columnar_store
+import driver_pool
+import market_store
+import page_cache
+import predictit_http
+import waits
+
+from predictit_cleaning import cleanup_markets
+
 import pandas as pd
 import numpy as np
+import io
 import os
+import queue
+import threading
 
 from bs4 import BeautifulSoup
-from selenium import webdriver
 from selenium import common
-from datetime import datetime, timedelta
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from datetime import date
 from webdriver_manager.chrome import ChromeDriverManager
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep, time
 
 '''
 Go to a predictit market website based on the state, election type, and
@@ -16,8 +30,13 @@ and clean up a .csv including prices and trade volumes for each party.
 
 '''
 
+# most browsers to scrape with at once, and the least time between
+# page loads across all of them, so we don't get rate limited
+MAX_WORKERS = 4
+MIN_REQUEST_INTERVAL = 1.0
 
-def main():
+
+def main(workers=1, backend='browser', incremental=False, warm=False):
     '''
     Turn a Predicit.com market into a .csv of pricing & trading info.
 
@@ -25,6 +44,17 @@ def main():
     volume for the relevant predictit.com market. Also, clean up the .csv
     a little bit, rename it, and deposit it in my projects folder.
 
+    Use `workers` browsers at once (up to MAX_WORKERS) to download markets,
+    or skip the browser and fetch them over HTTP with backend='http'.
+    backend='cache' re-cleans the markets saved by the last download
+    without fetching anything.
+
+    With `incremental`, keep every day we've pulled in the market history
+    store and only fetch the days each market is missing. The saved .csv
+    still has just the last 30 days, like a full pull.
+
+    With `warm`, keep the browsers open for the next run.
+
     '''
 
     # set how far back to get data
@@ -33,6 +63,16 @@ def main():
     # get all urls
     urls = pd.read_csv('predictit_market_urls.csv')
 
+    # only get what we don't already have for each market
+    if incremental:
+        store_path = projects + market_store.STORE_NAME
+        store = market_store.load_store(store_path)
+        latest = market_store.latest_dates(store)
+        date_range = [
+            market_store.choose_date_range(latest.get(url), date.today())
+            for url in urls.market_url
+            ]
+
     # file save name
     save_name = 'all_predictit_markets.csv'
 
@@ -47,181 +87,337 @@ def main():
         'price'
         ]
 
-    # save all markets into one .csv
-    all_markets = pd.DataFrame(columns=market_cols)
+    # download markets, in the same order as the urls
+    markets = scrape_markets(urls.market_url, date_range, workers, backend,
+                             warm)
 
-    # loop through each URL
-    for i in range(len(urls)):
+    # if market url was invalid, skip it
+    valid = [type(market) != str for market in markets]
 
-        # save data about the market
-        url = urls.market_url.iloc[i]
-        state = urls.state.iloc[i]
-        district = urls.district.iloc[i]
-        election = urls.election.iloc[i]
-        incumbent = urls.incumbent.iloc[i]
+    # a day at a time, like the store keeps them
+    if incremental:
+        markets = [market_store.daily(market, dr) if ok else market
+                   for market, dr, ok in zip(markets, date_range, valid)]
 
-        # download market & clean the data
-        market = data_prep(url, date_range)
+    markets = [market for market in markets if type(market) != str]
 
-        # if market url was invalid, skip to next
-        if type(market) == str:
-            continue
+    # data about each market to add to its rows
+    info = urls.loc[valid, ['election', 'state', 'district', 'incumbent',
+                            'market_url']]
 
-        # otherwise add in market data & save with the rest
-        else:
-            market['election'] = election
-            market['state'] = state
-            market['district'] = district
-            market['incumbent'] = incumbent
+    # clean all the markets at once & save them all together
+    all_markets = cleanup_markets(markets, info)
+    all_markets = all_markets[market_cols + ['market_url']]
+
+    # add the new days to the history, save all of it, and hand the
+    # modeling the same 30 days a full pull would
+    if incremental:
+        store = market_store.upsert(store, all_markets)
+        market_store.save_store(store, store_path)
+        all_markets = market_store.recent(store, date.today(),
+                                          urls.market_url)
 
-            all_markets = pd.concat([all_markets, market[market_cols]], axis=0)
+    all_markets = all_markets[market_cols]
 
     # save cleaned predictit markets to csv
     save_path = projects + save_name
     all_markets.to_csv(save_path, index=False)
 
+    # save a columnar copy too, if we're using one
+    if columnar_store.enabled():
+        columnar_store.write_dataset(
+            all_markets, 'markets',
+            root=projects + columnar_store.DATASET_DIR
+            )
 
-def data_prep(url, date_range):
+
+def scrape_markets(urls, date_range, workers=1, backend='browser',
+                   warm=False):
+    '''
+    Download every market in `urls`, and return the raw markets in the
+    same order as `urls`. `date_range` can be one date range for every
+    market, or a list with one for each market.
+
+    With more than one worker, each worker gets its own chrome and its own
+    download folder, so downloads from different markets can't collide.
+    With `warm`, the workers' chromes stay open for the next call.
+
+    '''
+
+    urls = list(urls)
+    workers = max(1, min(workers, MAX_WORKERS, len(urls)))
+
+    if isinstance(date_range, str):
+        date_range = [date_range] * len(urls)
+
+    if backend == 'http':
+        return fetch_markets(urls, date_range, workers)
+
+    if backend == 'cache':
+        return [cached_market(url) for url in urls]
+
+    if workers == 1:
+        return [data_prep(url, dr) for url, dr in zip(urls, date_range)]
+
+    # give each worker its own download folder and browser
+    slots = queue.Queue()
+    for k in range(workers):
+        download_dir = os.path.join(downloads, 'predictit_worker_%s' % k)
+        os.makedirs(download_dir, exist_ok=True)
+        if warm:
+            pool = driver_pool.warm_pool('predictit_worker_%s' % k,
+                                         download_dir=download_dir)
+        else:
+            pool = driver_pool.DriverPool(download_dir=download_dir)
+        slots.put((pool, download_dir))
+
+    def work(url, date_range):
+        pool, download_dir = slots.get()
+        try:
+            return data_prep(url, date_range, pool, download_dir)
+        finally:
+            slots.put((pool, download_dir))
+
+    try:
+        # map hands results back in url order no matter who finishes first
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            markets = list(executor.map(work, urls, date_range))
+
+    finally:
+        while not slots.empty():
+            pool = slots.get()[0]
+            if not warm:
+                pool.close()
+
+    return markets
+
+
+def fetch_markets(urls, date_range, workers=1, client=None):
+    '''
+    Fetch every market in `urls` over HTTP instead of with a browser, and
+    return the raw markets in the same order as `urls`.
+
+    '''
+
+    if client is None:
+        client = predictit_http.MarketHistoryClient()
+
+    if isinstance(date_range, str):
+        date_range = [date_range] * len(urls)
+
+    def work(url, date_range):
+        throttle()
+        market = client.fetch(url, date_range)
+
+        # save it like a downloaded .csv, to re-clean later if need be
+        if type(market) != str:
+            page_cache.default_cache().put(
+                'predictit', url, market.to_csv(index=False)
+                )
+
+        return market
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        markets = list(executor.map(work, urls, date_range))
+
+    return markets
+
+
+def data_prep(url, date_range, pool=None, download_dir=None):
     '''
     Take a market url and date range and download the market data.
 
     For a given market: send the request to download, handle the
-    file naming and directory, and send the data to be cleaned up a little.
+    file naming and directory, and load the raw .csv (all the markets get
+    cleaned up together later).
 
     '''
 
-    market_name = download_market(url, date_range)
+    load_path = download_market(url, date_range, pool, download_dir)
 
     # if market was invalid, return 'no_market'
-    if market_name == 'no_market':
-        market_clean = 'no_market'
+    if load_path == 'no_market':
+        market = 'no_market'
 
     else:
-        # file name can't have a '?', so it converts to '_'
-        name_list = list(market_name)
-        name_list[-1] = '_'
-        market_name = ''.join(name_list)
+        # keep a copy of the download & load in predictit market csv
+        with open(load_path, 'rb') as f:
+            raw = f.read()
+        page_cache.default_cache().put('predictit', url, raw)
+        market = pd.read_csv(io.BytesIO(raw))
 
-        # path and name for downloaded market .csv
-        load_path = downloads + market_name + '.csv'
+        # remove downloaded file to prevent duplicate naming
+        os.remove(load_path)
 
-        # load in predictit market csv
-        market = pd.read_csv(load_path)
+    return market
 
-        # send off to the cleaners
-        market_clean = cleanup_predictit(market)
 
-        # remove downloaded file to prevent duplicate naming
-        os.remove(load_path)
+def cached_market(url):
+    '''
+    Load the last .csv saved for a market url, or 'no_market' if we don't
+    have one.
+
+    '''
 
-    return market_clean
+    raw = page_cache.default_cache().latest('predictit', url)
 
+    if raw is None:
+        return 'no_market'
 
-def download_market(url, date_range):
+    return pd.read_csv(io.BytesIO(raw))
+
+
+def download_market(url, date_range, pool=None, download_dir=None):
     '''
     Use a URL to download a Predicit.com market and clean into a .csv.
 
     Download a .csv of market prices and trading volume for a given state,
-    election, and time frame. Also grab the name of the market to easily
-    access the csv.
+    election, and time frame, and return the path of the downloaded .csv.
+    Borrows a chrome from `pool` (by default the shared pool) instead of
+    starting a new one.
 
-    '''
+    Markets download to their worker's `download_dir` if given, otherwise
+    to the shared downloads folder. Either way, the market's .csv is found
+    by its name, so a late or left over file from another market can't be
+    taken for this one.
 
-    # open up chrome
-    driver = webdriver.Chrome(
-        executable_path=
-        '/Users/JonahKrop/Documents/Projects/predictit/chromedriver'
-        )
-    driver.get(url)
+    '''
 
-    # allow page to load
-    sleep(3)
+    if pool is None:
+        pool = driver_pool.default_pool()
 
-    soup = BeautifulSoup(driver.page_source, 'lxml')
+    # a worker's folder only ever holds the market it's on
+    if download_dir is not None:
+        clear_downloads(download_dir)
+    directory = download_dir or downloads
 
-    # grab market name
-    name = soup.find('h1').text
+    with pool.driver() as driver:
+        name = request_download(driver, url, date_range)
 
-    # determine how far back to get data
-    if date_range == '24hr':
-        driver.find_element_by_xpath("//*[contains(text(), '24hr')]").click()
-    elif date_range == '7d':
-        driver.find_element_by_xpath("//*[contains(text(), '7 Day')]").click()
-    elif date_range == '30d':
-        driver.find_element_by_xpath("//*[contains(text(), '30 Day')]").click()
-    elif date_range == '90d':
-        driver.find_element_by_xpath("//*[contains(text(), '90 Day')]").click()
+        # if market was invalid, return 'no_market'
+        if name == 'no_market':
+            return name
 
-    # try to download csv unless market is not valid
-    try:
-        driver.find_element_by_class_name('charts-header__download').click()
-    except common.exceptions.ElementClickInterceptedException:
-        name = 'no_market'
+        # file name can't have a '?', so it converts to '_'
+        name_list = list(name)
+        name_list[-1] = '_'
+        name = ''.join(name_list)
 
-    # allow time to download
-    sleep(2)
+        # hang on to the browser until the .csv finishes downloading
+        try:
+            load_path, took = waits.wait_for_download(directory,
+                                                      name + '.csv')
+        except TimeoutError:
+            # don't leave a partial or late file for the next market
+            print('%s never finished downloading' % name)
+            if download_dir is not None:
+                clear_downloads(download_dir)
+            else:
+                clear_downloads(downloads, name + '.csv')
+            return 'no_market'
 
-    driver.quit()
+    print('downloaded %s in %.1fs' % (name, took))
 
-    return name
+    return load_path
 
 
-def convert_date(day):
+def clear_downloads(directory, name=None):
     '''
-    Take 'Date' column from Predictit csv and return a datetime.
+    Delete the download `name` (finished or not) from `directory`, or
+    everything in it if no name is given.
 
     '''
 
-    day = datetime.strptime(day, '%m/%d/%Y %H:%M:%S %p').date()
+    if name is None:
+        files = os.listdir(directory)
+    else:
+        files = [name, name + '.crdownload']
+
+    for f in files:
+        try:
+            os.remove(os.path.join(directory, f))
+        except OSError:
+            pass
 
-    return day
 
+# when the last page load across all workers happened
+_last_request = [0.0]
+_request_lock = threading.Lock()
 
-def convert_price(price):
-    '''
-    Remove dollar sign from Predictit price column.
 
+def throttle():
     '''
+    Wait until at least MIN_REQUEST_INTERVAL has passed since any worker
+    last loaded a page.
 
-    price = price.split('$')[-1]
+    '''
 
-    return price
+    with _request_lock:
+        wait = _last_request[0] + MIN_REQUEST_INTERVAL - time()
+        if wait > 0:
+            sleep(wait)
+        _last_request[0] = time()
 
 
-def cleanup_predictit(market):
+def request_download(driver, url, date_range):
     '''
-    Clean up .csv downloaded from predictit.
-
-        - convert 'Date' column to datetime
-        - drop unneccesary price columns
-        - rename resulting columns
+    Go to the market page, pick the date range, and click download.
 
     '''
 
-    # convert to date column to datetime
-    market['market_date'] = market['Date'].apply(convert_date)
+    throttle()
+    driver.get(url)
 
-    # remove dollar sign from price column
-    market['price'] = market['CloseSharePrice'].apply(convert_price)
+    # wait for the market name and chart controls to load
+    try:
+        took = waits.wait_for_all(driver, [
+            EC.presence_of_element_located((By.TAG_NAME, 'h1')),
+            EC.presence_of_element_located(
+                (By.CLASS_NAME, 'charts-header__download')
+                )
+            ])
+    except waits.TimeoutException:
+        print('%s never loaded' % url)
+        return 'no_market'
+
+    print('loaded %s in %.1fs' % (url, took))
 
-    market = market.drop(columns=['OpenSharePrice',
-                                  'HighSharePrice',
-                                  'LowSharePrice',
-                                  'CloseSharePrice',
-                                  'Date'
-                                  ])
+    soup = BeautifulSoup(driver.page_source, 'lxml')
 
-    market = market.rename(columns={'ContractName': 'contract',
-                                    'TradeVolume': 'volume'
-                                    })
+    # grab market name
+    name = soup.find('h1').text
 
-    return market
+    # determine how far back to get data
+    if date_range == '24hr':
+        driver.find_element_by_xpath("//*[contains(text(), '24hr')]").click()
+    elif date_range == '7d':
+        driver.find_element_by_xpath("//*[contains(text(), '7 Day')]").click()
+    elif date_range == '30d':
+        driver.find_element_by_xpath("//*[contains(text(), '30 Day')]").click()
+    elif date_range == '90d':
+        driver.find_element_by_xpath("//*[contains(text(), '90 Day')]").click()
 
+    # try to download csv unless market is not valid
+    try:
+        driver.find_element_by_class_name('charts-header__download').click()
+    except common.exceptions.ElementClickInterceptedException:
+        name = 'no_market'
+
+    return name
 
-# if __name__ == "__main__":
 
 # set downloads & project folder paths
 downloads = '/Users/JonahKrop/Downloads/'
 projects = '/Users/JonahKrop/Documents/Projects/predictit/'
 
-main()
\ No newline at end of file
+# how many browsers to download markets with at once
+workers = 4
+
+# how to get market history
+backend = 'browser'  # ['browser', 'http', 'cache']
+
+# only fetch the days missing from the market history store
+incremental = True
+
+if __name__ == "__main__":
+    main(workers, backend, incremental)
\ No newline at end of file
@@ -0,0 +1,579 @@
+import columnar_store
+import mixed_model
+import simulation_stats
+
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+'''
+Simulate market prices from polling, the same way `market_price_modeling.R`
+does, but with all the simulations done together instead of one loop at a
+time:
+
+    - the polls and markets get read, cleaned, and joined together once
+    - every simulation's polling is drawn at once, as a (simulations x polls)
+      matrix, and ranked, netted, and turned into percents of the total for
+      all simulations together
+    - each simulation then fits the same mixed model as the R script,
+      `price ~ percent + net_polling + (1|incumbency) + (1|contract)`, and
+      predicts today's prices as a weighted average over recent polls. The
+      fits use `mixed_model`, which builds what it needs for a whole chunk
+      of simulations at once and starts each one from the fit to the
+      polling as published
+
+Simulations can be split up across processes. Each one draws from its own
+random stream, picked by the seed and the simulation's number, so a seed
+always gives exactly the same targets no matter how many processes run it.
+Each chunk of simulations gets added to running summaries for each market
+as it finishes (`simulation_stats`), rather than keeping them all.
+
+Writes the same targets .csv the R script does, plus a range for each
+market's predicted price and how often it came out a target.
+
+'''
+
+# where the scraped polls and markets are, and where targets go
+PROJECTS = '/Users/JonahKrop/Documents/Projects/predictit/'
+TARGET_DIR = PROJECTS + 'daily targets/'
+
+ELECTION_DAY = '2020-11-03'
+FIRST_POLL_DATE = '2020-07-01'
+
+# how many times to redraw the polling
+SIMULATIONS = 250
+
+# most processes to run simulations in at once, and most simulations to
+# fit together
+MAX_WORKERS = 4
+CHUNK_SIZE = 16
+
+# only use polls from the last two weeks, downweighting older ones
+MAX_RECENCY = 14
+RECENCY_WEIGHT = 0.008
+
+# biggest net polling lead that counts
+NET_CAP = 10
+
+# how far off a market's price has to be to be a target
+TARGET_RESIDUAL = 0.06
+
+# range of simulated prices to report for each market
+INTERVAL = (0.05, 0.95)
+
+MARKET_KEY = ['election', 'state', 'district', 'contract', 'market_date',
+              'price']
+
+# what makes two polls the same, after they've been redrawn
+POLL_KEY = ['election', 'state', 'district', 'party', 'poll_date',
+            'pollster', 'sponsored', 'pollster_grade', 'poll_sample',
+            'voter_type']
+
+
+def main(simulations=SIMULATIONS, today=None, seed=None, workers=1):
+    '''
+    Simulate market prices from today's polls and markets and save the
+    markets whose price is off by at least TARGET_RESIDUAL.
+
+    Predicts prices for `today` (yesterday by default, like the R script).
+    Runs the simulations in `workers` processes. Without a `seed`, picks
+    one and prints it, so the same targets can be made again.
+
+    '''
+
+    if today is None:
+        today = date.today() - timedelta(days=1)
+
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    print('simulating with seed %s' % seed)
+
+    simulation = Simulation(load_markets(), load_polls(), today)
+
+    results = simulation.run(simulations, seed, workers)
+    targets = find_targets(results)
+
+    save_name = '%s-targets.csv' % today
+    targets.to_csv(TARGET_DIR + save_name, index=False)
+
+    print('Targets Acquired')
+
+    return targets
+
+
+def load_polls():
+    '''
+    Load the senate and house polls from the .csv's (or the columnar copy,
+    if we're saving one).
+
+    '''
+
+    if columnar_store.enabled():
+        polls = columnar_store.read_dataset(
+            'polls', start=FIRST_POLL_DATE,
+            root=PROJECTS + columnar_store.DATASET_DIR
+            )
+    else:
+        polls = pd.concat([pd.read_csv(PROJECTS + '_senate_polling.csv'),
+                           pd.read_csv(PROJECTS + '_house_polling.csv')],
+                          axis=0, ignore_index=True)
+
+    return polls
+
+
+def load_markets():
+    '''
+    Load the predictit markets from the .csv (or the columnar copy, if we're
+    saving one).
+
+    '''
+
+    if columnar_store.enabled():
+        markets = columnar_store.read_dataset(
+            'markets', root=PROJECTS + columnar_store.DATASET_DIR
+            )
+    else:
+        markets = pd.read_csv(PROJECTS + 'all_predictit_markets.csv')
+
+    return markets
+
+
+def setup_polls(polls):
+    '''
+    Prepare the polls for redrawing:
+        - drop GA to ignore special elections
+        - drop polls from before July
+        - total polling for each poll
+        - polling error, bigger the further out from the election
+        - sort by poll, so each poll's candidates are next to each other
+
+    '''
+
+    polls = polls[polls['state'] != 'georgia'].copy()
+
+    polls['poll_date'] = pd.to_datetime(polls['poll_date'])
+    polls = polls[polls['poll_date'] >= FIRST_POLL_DATE]
+
+    polls['total_polling'] = polls.groupby('poll_id')['polling'].transform(
+        'sum'
+        )
+
+    weeks_out = (pd.Timestamp(ELECTION_DAY) - polls['poll_date']).dt.days
+    weeks_out = (weeks_out / 7).astype(int)
+    polls['polling_error'] = np.round(2 * weeks_out ** 0.25, 1)
+
+    polls = polls.sort_values('poll_id', kind='stable')
+
+    return polls.reset_index(drop=True)
+
+
+def setup_markets(markets):
+    '''
+    Prepare the markets: drop GA, and call every contract that isn't
+    Democratic or Republican Independent.
+
+    '''
+
+    markets = markets[markets['state'] != 'georgia'].copy()
+
+    markets['market_date'] = pd.to_datetime(markets['market_date'])
+
+    major = markets['contract'].isin(['Democratic', 'Republican'])
+    markets.loc[~major, 'contract'] = 'Independent'
+
+    return markets.reset_index(drop=True)
+
+
+class Simulation:
+    '''
+    Everything about the simulations that doesn't depend on the draws,
+    worked out once: which polls go with which market days, how much each
+    one counts, and which are for training and which predict today.
+
+        simulation = Simulation(markets, polls, today)
+        results = simulation.run(250, rng)
+
+    '''
+
+    def __init__(self, markets, polls, today):
+        self.markets = setup_markets(markets)
+        self.polls = setup_polls(polls)
+        self.today = pd.Timestamp(today)
+
+        polls = self.polls
+
+        # each poll's position, and where each poll's candidates start
+        poll_codes = polls['poll_id'].factorize()[0]
+        sizes = np.bincount(poll_codes)
+        starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+
+        self.poll_codes = poll_codes
+        self.polling = polls['polling'].values.astype(float)
+        self.polling_error = polls['polling_error'].values
+        self.total_polling = polls['total_polling'].values.astype(float)
+
+        # only polls with at least two candidates have a top two
+        self.first = starts[sizes >= 2]
+
+        # redrawn polls that match on everything count once
+        self.poll_key = polls[POLL_KEY].astype(str).agg('|'.join, axis=1)
+        self.poll_key = self.poll_key.factorize()[0]
+
+        self.join()
+
+        # the model's groups are the same in every simulation, and every fit
+        # starts from the fit to the polling as published
+        self.model = mixed_model.RandomIntercepts({
+            'incumbency': self.train['incumbency'].values,
+            'contract': self.train['contract'].values
+            })
+        percent, net, keep = self.top_two(self.polling[None, :])
+        self.start = self.fit(percent, net, keep)[0]['theta']
+
+    def join(self):
+        '''
+        Match every market day to the polls for its race & contract from
+        the two weeks before it, and split them into training days (before
+        `today`) and prediction days (`today`).
+
+        '''
+
+        pairs = window_join(self.markets, self.polls)
+
+        pairs['incumbency'] = (pairs['incumbent'] ==
+                               pairs['contract']).astype(int)
+
+        train = pairs[pairs['market_date'] < self.today]
+        test = pairs[pairs['market_date'] == self.today]
+
+        self.train = train.reset_index(drop=True)
+        self.test = test.reset_index(drop=True)
+
+        # the markets that get a prediction today
+        self.today_rows = np.unique(self.test['market_row'].values)
+
+    def draw(self, simulations, seed):
+        '''
+        Redraw every poll once for each of the `simulations` (a list of
+        simulation numbers), from a normal distribution with mean = polling
+        and sd = polling error. Returns a (simulations x polls) matrix.
+
+        '''
+
+        noise = np.array([
+            simulation_rng(seed, s).standard_normal(len(self.polling))
+            for s in simulations
+            ])
+
+        return np.round(self.polling + self.polling_error * noise)
+
+    def top_two(self, drawn):
+        '''
+        Rank the candidates in each poll of each simulation, all at once,
+        and keep the top two. Returns (simulations x polls) matrices of
+        each candidate's percent of the poll's total and net polling over
+        the other top candidate, and which candidates were kept.
+
+        '''
+
+        simulations, n = drawn.shape
+
+        # sort each simulation by poll, then polling from highest to lowest
+        # (ties stay in their original order, like R's order())
+        spread = drawn.max() - drawn.min() + 1
+        key = self.poll_codes * spread + (drawn.max() - drawn)
+        order = np.argsort(key, axis=1, kind='stable')
+
+        # the first two spots in each poll are its top two
+        top1 = order[:, self.first]
+        top2 = order[:, self.first + 1]
+        polling1 = np.take_along_axis(drawn, top1, axis=1)
+        polling2 = np.take_along_axis(drawn, top2, axis=1)
+
+        rows = np.concatenate([top1, top2], axis=1)
+        polling = np.concatenate([polling1, polling2], axis=1)
+        net = np.clip(np.concatenate([polling1 - polling2,
+                                      polling2 - polling1], axis=1),
+                      -NET_CAP, NET_CAP)
+        percent = np.round(polling / self.total_polling[rows], 2)
+
+        keep = np.zeros((simulations, n), dtype=bool)
+        np.put_along_axis(keep, rows, self.distinct(rows, percent, net),
+                          axis=1)
+
+        full_percent = np.zeros((simulations, n))
+        full_net = np.zeros((simulations, n))
+        np.put_along_axis(full_percent, rows, percent, axis=1)
+        np.put_along_axis(full_net, rows, net, axis=1)
+
+        return full_percent, full_net, keep
+
+    def distinct(self, rows, percent, net):
+        '''
+        Mark the first of any candidates in a simulation that came out
+        exactly the same (same poll details, percent, and net polling), so
+        duplicates only count once.
+
+        '''
+
+        code = self.poll_key[rows].astype(np.int64)
+        code = code * 100000 + (np.round(percent * 100).astype(np.int64)
+                                + 50000)
+        code = code * (2 * NET_CAP + 1) + (net.astype(np.int64) + NET_CAP)
+
+        order = np.argsort(code, axis=1, kind='stable')
+        ranked = np.take_along_axis(code, order, axis=1)
+
+        first = np.ones(code.shape, dtype=bool)
+        first[:, 1:] = ranked[:, 1:] != ranked[:, :-1]
+
+        distinct = np.empty(code.shape, dtype=bool)
+        np.put_along_axis(distinct, order, first, axis=1)
+
+        return distinct
+
+    def run(self, simulations, seed, workers=1):
+        '''
+        Run `simulations` simulations and return each market's price, and
+        its predicted price averaged across them.
+
+        With more than one worker, the chunks of simulations get run in
+        separate processes. Either way, chunks are the same size and get
+        added up in order, so the results are the same however many
+        workers there are.
+
+        '''
+
+        workers = max(1, min(workers, MAX_WORKERS, simulations))
+        chunks = [np.arange(start, min(start + CHUNK_SIZE, simulations))
+                  for start in range(0, simulations, CHUNK_SIZE)]
+
+        prices = self.markets['price'].values[self.today_rows]
+        stats = simulation_stats.MarketAccumulator(len(self.today_rows),
+                                                   TARGET_RESIDUAL)
+
+        if workers == 1:
+            for chunk in chunks:
+                stats.update(self.simulate(chunk, seed), prices)
+
+        else:
+            # each process gets its own copy of the simulation, once.
+            # spawned, not forked, since other stages' threads may be
+            # holding locks a forked copy would inherit held
+            spawn = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers,
+                                     mp_context=spawn,
+                                     initializer=start_worker,
+                                     initargs=(self,)) as executor:
+                for predicted in executor.map(simulate_chunk, chunks,
+                                              [seed] * len(chunks)):
+                    stats.update(predicted, prices)
+
+        return self.results(stats)
+
+    def simulate(self, simulations, seed):
+        '''
+        Run the simulations numbered `simulations` and return each one's
+        predicted price for every market being predicted today.
+
+        '''
+
+        percent, net, keep = self.top_two(self.draw(simulations, seed))
+        fits = self.fit(percent, net, keep, self.start)
+
+        return np.array([
+            self.predict(percent[s], net[s], keep[s], fits[s])
+            for s in range(len(simulations))
+            ])[:, self.today_rows]
+
+    def fit(self, percent, net, keep, start=None):
+        '''
+        Fit the mixed model to each simulation's training days.
+
+        '''
+
+        rows = self.train['poll_row'].values
+
+        X = np.stack([np.ones((len(percent), len(rows))),
+                      percent[:, rows], net[:, rows]], axis=2)
+
+        return self.model.fit_batch(X, self.train['price'].values,
+                                    keep[:, rows], start)
+
+    def predict(self, percent, net, keep, fit):
+        '''
+        Predict today's prices from one simulation's fit and average them
+        for each market, weighting newer polls more. Returns the predicted
+        price for each market row (NaN for markets without any polls
+        today).
+
+        '''
+
+        test = self.test[keep[self.test['poll_row'].values]]
+
+        price = design(percent, net, test['poll_row'].values) @ fit['fixed']
+        for name, levels in [('incumbency', test['incumbency'].values),
+                             ('contract', test['contract'].values)]:
+            price += pd.Series(levels).map(fit['random'][name]).fillna(
+                0
+                ).values
+
+        # weighted average prediction for each market
+        weight = test['poll_weight'].values
+        rows = test['market_row'].values
+        n = len(self.markets)
+        num = np.bincount(rows, price * weight, minlength=n)
+        denom = np.bincount(rows, weight, minlength=n)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.round(num / denom, 2)
+
+    def results(self, stats):
+        '''
+        Each market's predicted price, averaged over the simulations it
+        showed up in, compared to the market's price. Also the range of
+        its simulated prices (INTERVAL) and how often it was a target.
+
+        '''
+
+        found = stats.count > 0
+        rows = self.today_rows[found]
+
+        results = self.markets.loc[rows, MARKET_KEY].copy()
+        results['price_predict'] = np.round(stats.mean()[found], 2)
+        results['price_resid'] = results['price'] - results['price_predict']
+        results['predict_sd'] = np.round(stats.std()[found], 4)
+        results['predict_low'] = stats.quantile(INTERVAL[0])[found]
+        results['predict_high'] = stats.quantile(INTERVAL[1])[found]
+        results['target_probability'] = np.round(
+            stats.exceed_probability()[found], 3
+            )
+
+        results = results.sort_values(MARKET_KEY)
+
+        return results.reset_index(drop=True)
+
+
+# the simulation a worker process is running
+_simulation = None
+
+
+def start_worker(simulation):
+    '''
+    Hang on to the simulation in a worker process.
+
+    '''
+
+    global _simulation
+    _simulation = simulation
+
+
+def simulate_chunk(simulations, seed):
+    '''
+    Run a chunk of simulations in a worker process.
+
+    '''
+
+    return _simulation.simulate(simulations, seed)
+
+
+def simulation_rng(seed, simulation):
+    '''
+    Return the random numbers for one simulation: a Philox stream keyed by
+    `seed` that starts at its own counter block for each simulation, so
+    every simulation gets the same draws however they're split up.
+
+    '''
+
+    bit_generator = np.random.Philox(key=seed % 2 ** 128,
+                                     counter=[0, 0, 0, simulation])
+
+    return np.random.Generator(bit_generator)
+
+
+def window_join(markets, polls, max_recency=MAX_RECENCY):
+    '''
+    Pair every market day with the polls for its race & contract from the
+    `max_recency` days up to and including it, with each pair's
+    poll_recency and poll_weight.
+
+    Rather than pairing every market day with every poll and throwing most
+    away, polls get sorted by race & date, and binary search finds where
+    each market day's window starts and ends, so only the pairs that are
+    kept ever get made.
+
+    '''
+
+    key = ['election', 'state', 'district']
+    market_keys = markets[key].assign(party=markets['contract'])
+    poll_keys = polls[key + ['party']]
+
+    # the same number for the same race & contract in both
+    codes = pd.concat([market_keys, poll_keys], axis=0, ignore_index=True)
+    codes = codes.groupby(key + ['party'], sort=False).ngroup().values
+    market_codes, poll_codes = codes[:len(markets)], codes[len(markets):]
+
+    # days since the epoch, so race & day sort together as one number
+    span = 10 ** 6
+    market_days = markets['market_date'].values.astype('datetime64[D]')
+    market_days = market_days.astype(np.int64)
+    poll_days = polls['poll_date'].values.astype('datetime64[D]')
+    poll_days = poll_days.astype(np.int64)
+
+    poll_order = np.argsort(poll_codes * span + poll_days, kind='stable')
+    sorted_polls = (poll_codes * span + poll_days)[poll_order]
+
+    market_values = market_codes * span + market_days
+    start = np.searchsorted(sorted_polls, market_values - max_recency,
+                            side='left')
+    end = np.searchsorted(sorted_polls, market_values, side='right')
+
+    # every (market day, poll) pair in each window
+    sizes = end - start
+    market_rows = np.repeat(np.arange(len(markets)), sizes)
+    offsets = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes,
+                                                 sizes)
+    poll_rows = poll_order[np.repeat(start, sizes) + offsets]
+
+    pairs = markets.iloc[market_rows].reset_index(drop=True)
+    pairs['market_row'] = market_rows
+    pairs['poll_row'] = poll_rows
+    pairs['poll_date'] = polls['poll_date'].values[poll_rows]
+
+    recency = market_days[market_rows] - poll_days[poll_rows]
+    pairs['poll_recency'] = recency
+    pairs['poll_weight'] = 1 - RECENCY_WEIGHT * recency
+
+    return pairs
+
+
+def design(percent, net, rows):
+    '''
+    Fixed effects design matrix for polls `rows`: intercept, percent, and
+    net polling.
+
+    '''
+
+    return np.column_stack([np.ones(len(rows)), percent[rows], net[rows]])
+
+
+def find_targets(results):
+    '''
+    Markets whose price is off from the prediction by TARGET_RESIDUAL or
+    more.
+
+    '''
+
+    targets = results[results['price_resid'].abs() >= TARGET_RESIDUAL]
+    targets = targets.copy()
+    targets['market_date'] = targets['market_date'].dt.strftime('%Y-%m-%d')
+
+    return targets.reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    main()
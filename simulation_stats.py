@@ -0,0 +1,123 @@
+import numpy as np
+
+'''
+Summarize each market's simulated prices as the simulations come in, instead
+of stacking every simulation's results and grouping them at the end. Memory
+stays the same however many simulations there are: a count, running mean and
+variance (Welford's method, merged a chunk of simulations at a time), a
+histogram to read quantiles from, and how often the price was off by enough
+to be a target.
+
+'''
+
+# simulated prices are rounded to the cent, so cent-wide bins lose nothing;
+# anything outside the range goes in the end bins
+BIN_WIDTH = 0.01
+BIN_RANGE = (-1.0, 2.0)
+
+
+class MarketAccumulator:
+    '''
+    Running summaries of simulated prices for each of `markets` markets.
+
+        stats = MarketAccumulator(len(prices))
+        for chunk in chunks:
+            stats.update(chunk, prices)
+        stats.mean(), stats.quantile(0.05), stats.exceed_probability()
+
+    '''
+
+    def __init__(self, markets, threshold=0.06):
+        self.threshold = threshold
+
+        self.count = np.zeros(markets, dtype=np.int64)
+        self.total = np.zeros(markets)
+        self.running_mean = np.zeros(markets)
+        self.m2 = np.zeros(markets)
+        self.exceed = np.zeros(markets, dtype=np.int64)
+
+        bins = int(round((BIN_RANGE[1] - BIN_RANGE[0]) / BIN_WIDTH)) + 1
+        self.histogram = np.zeros((markets, bins), dtype=np.int64)
+
+    def update(self, predicted, prices):
+        '''
+        Add a chunk of simulations: `predicted` is (simulations x markets),
+        NaN where a market didn't get a prediction.
+
+        '''
+
+        seen = ~np.isnan(predicted)
+        values = np.where(seen, predicted, 0)
+
+        count = seen.sum(axis=0)
+        total = values.sum(axis=0)
+
+        # merge the chunk's mean and variance into the running ones
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, total / count, 0)
+        m2 = (np.where(seen, predicted - mean, 0) ** 2).sum(axis=0)
+
+        new_count = self.count + count
+        delta = mean - self.running_mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = np.where(new_count > 0, count / new_count, 0)
+        self.running_mean = self.running_mean + delta * weight
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * weight
+        self.count = new_count
+        self.total = self.total + total
+
+        # how often the price was off by at least the threshold
+        off = np.round(np.abs(prices - values), 2) >= self.threshold
+        self.exceed += (off & seen).sum(axis=0)
+
+        # histogram of the simulated prices
+        bins = np.round((values - BIN_RANGE[0]) / BIN_WIDTH).astype(int)
+        bins = np.clip(bins, 0, self.histogram.shape[1] - 1)
+        markets = np.broadcast_to(np.arange(predicted.shape[1]), bins.shape)
+        np.add.at(self.histogram, (markets[seen], bins[seen]), 1)
+
+    def mean(self):
+        '''
+        Each market's average simulated price (NaN if it never had one).
+        Taken from the plain total, so it's exactly what averaging every
+        simulation at the end would give.
+
+        '''
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 0, self.total / self.count, np.nan)
+
+    def std(self):
+        '''
+        Each market's standard deviation of simulated prices.
+
+        '''
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1,
+                            np.sqrt(self.m2 / (self.count - 1)), np.nan)
+
+    def quantile(self, q):
+        '''
+        Each market's `q` quantile of simulated prices, from the histogram:
+        the lowest price at least `q` of the simulations were at or below.
+
+        '''
+
+        cumulative = np.cumsum(self.histogram, axis=1)
+        needed = np.maximum(np.ceil(q * self.count), 1)
+        bins = (cumulative < needed[:, None]).sum(axis=1)
+        bins = np.minimum(bins, self.histogram.shape[1] - 1)
+
+        return np.where(self.count > 0,
+                        np.round(BIN_RANGE[0] + bins * BIN_WIDTH, 2), np.nan)
+
+    def exceed_probability(self):
+        '''
+        Share of simulations where the market's price was off from the
+        simulated price by at least the threshold.
+
+        '''
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 0, self.exceed / self.count, np.nan)
@@ -0,0 +1,83 @@
+import pandas as pd
+import pytest
+
+import columnar_store
+import simulate_markets
+
+'''
+Polls saved for both chambers should read back ready to join to the markets.
+
+'''
+
+
+def chamber(election, district):
+    return pd.DataFrame({
+        'poll_id': ['1', '2'],
+        'election': [election] * 2,
+        'state': ['maine'] * 2,
+        'district': [district] * 2,
+        'party': ['DEM', 'REP'],
+        'poll_date': ['2020-09-28', '2020-09-28'],
+        'candidate_poll': [51, 45]
+        })
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'feather'])
+def test_polls_join_markets_after_round_trip(tmp_path, fmt):
+    # senate districts are 0, house ones come off the page as strings
+    columnar_store.write_dataset(chamber('senate', 0), 'polls', fmt,
+                                 root=str(tmp_path))
+    columnar_store.write_dataset(chamber('house', '2'), 'polls', fmt,
+                                 root=str(tmp_path))
+
+    polls = columnar_store.read_dataset('polls', fmt=fmt, root=str(tmp_path))
+    assert sorted(polls['district']) == [0, 0, 2, 2]
+
+    markets = pd.DataFrame({
+        'election': ['senate', 'house'],
+        'state': ['maine', 'maine'],
+        'district': [0, 2],
+        'incumbent': ['REP', 'DEM'],
+        'contract': ['DEM', 'DEM'],
+        'market_date': pd.to_datetime(['2020-09-30', '2020-09-30']),
+        'price': [0.6, 0.7]
+        })
+
+    pairs = simulate_markets.window_join(markets, polls)
+
+    assert sorted(pairs['market_row']) == [0, 1]
+    assert list(pairs['poll_recency']) == [2, 2]
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'feather'])
+def test_snapshot_drops_states_missing_from_the_new_pull(tmp_path, fmt):
+    polls = pd.concat([chamber('senate', 0),
+                       chamber('senate', 0).assign(state='ohio')])
+    columnar_store.write_dataset(polls, 'polls', fmt, root=str(tmp_path))
+    columnar_store.write_dataset(chamber('house', '2'), 'polls', fmt,
+                                 root=str(tmp_path))
+    columnar_store.write_dataset(chamber('senate', 0), 'polls', fmt,
+                                 root=str(tmp_path))
+
+    polls = columnar_store.read_dataset('polls', fmt=fmt, root=str(tmp_path))
+
+    assert sorted(zip(polls['election'], polls['state'])) == [
+        ('house', 'maine'), ('house', 'maine'),
+        ('senate', 'maine'), ('senate', 'maine')
+        ]
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'feather'])
+def test_appends_keep_every_pull(tmp_path, fmt):
+    margins = pd.DataFrame({'state': ['maine'], 'date': ['2020-09-28'],
+                            'biden_margin': [4.0]})
+
+    # back to back, in the same second
+    for _ in range(2):
+        columnar_store.write_dataset(margins, 'economist_margins', fmt,
+                                     root=str(tmp_path))
+
+    saved = columnar_store.read_dataset('economist_margins', fmt=fmt,
+                                        root=str(tmp_path))
+
+    assert len(saved) == 2
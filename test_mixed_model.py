@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import mixed_model
+
+'''
+Compare REML fits with lme4's, recorded from
+`lmer(endog ~ 0 + exog_fe_0 + ... + (1 | groups), REML=TRUE)` on the
+datasets in fixtures/ (statsmodels' lme4 reference data).
+
+'''
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+# dataset: (fixed effects, group variance, residual variance, REML criterion)
+LME4 = {
+    'lme01.csv': ([-0.9115929], 2.839777e-14, 4.066932, 1078.6248),
+    'lme03.csv': ([-1.027583, 0.8605714], 0.8117898, 3.13369, 959.0708),
+    'lme04.csv': ([-1.005067, -0.003496032, 1.054666], 0.1705659,
+                  0.2556394, 477.522)
+    }
+
+
+@pytest.mark.parametrize('name', sorted(LME4))
+def test_matches_lme4(name):
+    data = pd.read_csv(os.path.join(FIXTURES, name))
+    X = data.filter(like='exog_fe').values
+
+    model = mixed_model.RandomIntercepts({'groups': data['groups'].values})
+    fit = model.fit_batch(X[None], data['endog'].values)[0]
+
+    fixed, group_var, residual_var, deviance = LME4[name]
+    sigma2 = fit['sigma'] ** 2
+
+    np.testing.assert_allclose(fit['fixed'], fixed, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(fit['theta'][0] ** 2 * sigma2, group_var,
+                               rtol=1e-4, atol=1e-6)
+    np.testing.assert_allclose(sigma2, residual_var, rtol=1e-5)
+    np.testing.assert_allclose(fit['deviance'], deviance, atol=1e-3)
+
+
+def test_start_on_the_bound_matches_lme4():
+    # a fit that starts far off can overshoot onto theta = 0 and stop
+    data = pd.read_csv(os.path.join(FIXTURES, 'lme03.csv'))
+    X = data.filter(like='exog_fe').values
+
+    model = mixed_model.RandomIntercepts({'groups': data['groups'].values})
+    fit = model.fit_batch(X[None], data['endog'].values,
+                          start=np.array([5.0]))[0]
+
+    np.testing.assert_allclose(fit['deviance'], LME4['lme03.csv'][3],
+                               atol=1e-3)
@@ -0,0 +1,30 @@
+import os
+
+import polls_feed
+
+'''
+Read 538's polls feed from a local fixture file.
+
+'''
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures',
+                       'senate_polls.csv')
+
+
+def test_load_polls_from_fixture():
+    polls = polls_feed.load_polls('senate', FIXTURE, 'maine')
+
+    # the blank answer, the ranked choice matchup, and the poll without a
+    # sample size are all left out
+    assert list(polls.columns) == polls_feed.POLL_COLUMNS
+    assert list(polls['candidate']) == ['Gideon', 'Collins']
+    assert list(polls['party']) == ['Democratic', 'Republican']
+    assert list(polls['poll_sample']) == [847, 847]
+    assert list(polls['sponsored']) == [1, 1]
+
+
+def test_polling_rounds_halves_up():
+    polls = polls_feed.load_polls('senate', FIXTURE)
+
+    assert list(polls['polling']) == [49, 46]
+    assert list(polls['net_polling']) == [3, 3]
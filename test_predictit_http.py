@@ -0,0 +1,93 @@
+import io
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pandas as pd
+import pytest
+
+import predictit_http
+
+from predictit_cleaning import cleanup_predictit
+
+'''
+Fetch market history from a stub of predictit's chart api on localhost.
+
+'''
+
+URL = 'https://www.predictit.org/markets/detail/5808/Which-party-will-win'
+
+HISTORY = [
+    {'contractName': 'Democratic', 'date': '2020-10-01T23:59:00',
+     'openSharePrice': 0.61, 'highSharePrice': 0.63,
+     'lowSharePrice': 0.6, 'closeSharePrice': 0.62, 'tradeVolume': 1200},
+    {'contractName': 'Republican', 'date': '2020-10-01T23:59:00',
+     'openSharePrice': 0.4, 'highSharePrice': 0.41,
+     'lowSharePrice': 0.37, 'closeSharePrice': 0.38, 'tradeVolume': 900}
+    ]
+
+# the same two rows as the browser's "download" button gives them
+DOWNLOAD = '''ContractName,Date,OpenSharePrice,HighSharePrice,LowSharePrice,CloseSharePrice,TradeVolume
+Democratic,10/01/2020 11:59:00 PM,$0.61,$0.63,$0.60,$0.62,1200
+Republican,10/01/2020 11:59:00 PM,$0.40,$0.41,$0.37,$0.38,900
+'''
+
+# market id: (status, body)
+RESPONSES = {
+    '5808': (200, json.dumps(HISTORY)),
+    '1': (200, '<html>down for maintenance</html>'),
+    '2': (200, json.dumps([{'contractName': 'Democratic'}])),
+    '3': (200, '[]'),
+    '4': (500, '')
+    }
+
+
+class ChartHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        market = self.path.split('?')[0].rstrip('/').split('/')[-1]
+        status, body = RESPONSES.get(market, (404, ''))
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def client():
+    server = HTTPServer(('127.0.0.1', 0), ChartHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    transport = predictit_http.SessionTransport(retries=0)
+    yield predictit_http.MarketHistoryClient(
+        transport, base_url='http://127.0.0.1:%d' % server.server_port
+        )
+
+    transport.close()
+    server.shutdown()
+
+
+def test_fetch_matches_browser_download(client):
+    fetched = client.fetch(URL, '30d')
+    downloaded = pd.read_csv(io.StringIO(DOWNLOAD))
+
+    pd.testing.assert_frame_equal(fetched, downloaded, check_dtype=False)
+    pd.testing.assert_frame_equal(cleanup_predictit(fetched),
+                                  cleanup_predictit(downloaded))
+
+
+@pytest.mark.parametrize('url', [
+    'https://www.predictit.org/markets/browse',
+    'https://www.predictit.org/markets/detail/1/bad-body',
+    'https://www.predictit.org/markets/detail/2/missing-keys',
+    'https://www.predictit.org/markets/detail/3/no-history',
+    'https://www.predictit.org/markets/detail/4/server-error'
+    ])
+def test_bad_markets_are_no_market(client, url):
+    assert client.fetch(url, '30d') == 'no_market'
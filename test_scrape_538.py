@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+import scrape_538
+
+'''
+Heat-map colors from 538's poll rows, and the polls feed against the page.
+
+'''
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def test_hex_to_rgb():
+    styles = ['background-color:#ffd2c0;', 'background-color:#2E3C85;']
+
+    assert scrape_538.hex_to_rgb(styles).tolist() == [[255, 210, 192],
+                                                       [46, 60, 133]]
+
+
+def test_hex_to_rgb_expands_short_colors():
+    styles = ['background-color:#f00;', 'background-color:#ffd2c0;']
+
+    assert scrape_538.hex_to_rgb(styles).tolist() == [[255, 0, 0],
+                                                       [255, 210, 192]]
+
+
+@pytest.mark.parametrize('style', ['background-color:#ff00;',
+                                   'background-color:#zzzzzz;',
+                                   'background-color:#ffd2g0;',
+                                   'background-color:#f0;',
+                                   'background-color:red;'])
+def test_hex_to_rgb_rejects_malformed_colors(style):
+    with pytest.raises(ValueError):
+        scrape_538.hex_to_rgb(['background-color:#ffd2c0;', style])
+
+
+def test_feed_matches_page(monkeypatch):
+    with open(os.path.join(FIXTURES, 'maine_senate_polls.html')) as f:
+        page = f.read()
+    monkeypatch.setattr(scrape_538, 'cached_state_polling',
+                        lambda state, election: page)
+
+    scraped = scrape_538.scrape_polls('maine', 'senate', 'cache')
+    fed = scrape_538.scrape_polls('maine', 'senate', 'feed',
+                                  os.path.join(FIXTURES, 'senate_polls.csv'))
+
+    # poll ids are made up differently, and the page's polling is text
+    assert list(fed.columns) == list(scraped.columns)
+    assert (fed.drop(columns='poll_id').astype(str).values.tolist() ==
+            scraped.drop(columns='poll_id').astype(str).values.tolist())
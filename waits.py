@@ -0,0 +1,142 @@
+import os
+
+from selenium import common
+from selenium.webdriver.support.ui import WebDriverWait
+from time import sleep, time
+
+'''
+Wait for pages and downloads to actually be ready instead of sleeping a fixed
+amount of time and hoping. Every wait has a timeout and returns how long it
+really took.
+
+'''
+
+PAGE_TIMEOUT = 15
+DOWNLOAD_TIMEOUT = 30
+
+# how often to check
+POLL_INTERVAL = 0.1
+
+
+def wait_for(driver, condition, timeout=PAGE_TIMEOUT):
+    '''
+    Wait until `condition(driver)` is truthy, e.g. one of selenium's
+    expected_conditions. Returns (result, seconds waited), or raises
+    selenium's TimeoutException.
+
+    '''
+
+    start = time()
+    result = WebDriverWait(driver, timeout, POLL_INTERVAL).until(condition)
+
+    return result, time() - start
+
+
+def wait_for_all(driver, conditions, timeout=PAGE_TIMEOUT):
+    '''
+    Wait until every condition is met, sharing one timeout between them.
+    Returns seconds waited.
+
+    '''
+
+    start = time()
+    for condition in conditions:
+        remaining = max(timeout - (time() - start), 0)
+        wait_for(driver, condition, remaining)
+
+    return time() - start
+
+
+def wait_for_download(directory, name=None, timeout=DOWNLOAD_TIMEOUT):
+    '''
+    Watch a folder until a .csv (or the file `name`, if given) shows up and
+    is fully written: chrome has no partial downloads left and the file
+    stopped growing. Returns (path, seconds waited), or raises TimeoutError.
+
+    '''
+
+    start = time()
+    last_size = None
+
+    while time() - start < timeout:
+
+        files = os.listdir(directory)
+
+        # chrome writes to a .crdownload file until it's done
+        partial = [f for f in files if f.endswith('.crdownload')]
+
+        if name is not None:
+            done = [f for f in files if f == name]
+        else:
+            done = [f for f in files if f.endswith('.csv')]
+
+        if done and not partial:
+            path = max([os.path.join(directory, f) for f in done],
+                       key=os.path.getmtime)
+            size = os.path.getsize(path)
+
+            # make sure it isn't still being written
+            if size > 0 and size == last_size:
+                return path, time() - start
+            last_size = size
+
+        sleep(POLL_INTERVAL)
+
+    raise TimeoutError('no finished download in %s after %ss' %
+                       (directory, timeout))
+
+
+def page_grew(script, height):
+    '''
+    Condition for `wait_for`: the page's scroll height is no longer
+    `height`.
+
+    '''
+
+    def condition(driver):
+        return driver.execute_script(script) != height
+
+    return condition
+
+
+def more_elements(class_name, count):
+    '''
+    Condition for `wait_for`: there are more than `count` elements with the
+    class `class_name` on the page.
+
+    '''
+
+    def condition(driver):
+        return len(driver.find_elements_by_class_name(class_name)) > count
+
+    return condition
+
+
+def stable_text(selector, count, text=''):
+    '''
+    Condition for `wait_for`: the first `count` elements matching the CSS
+    `selector` (the same ones a parser taking the first `count` would read)
+    have all rendered with `text` in them, and their text hasn't changed
+    since the last check (so a number that counts up as it draws has
+    settled). Returns the elements' text.
+
+    '''
+
+    script = '''
+        return Array.from(document.querySelectorAll(arguments[0]))
+            .slice(0, arguments[1])
+            .map(function (e) { return e.textContent; });
+        '''
+    last = [None]
+
+    def condition(driver):
+        found = driver.execute_script(script, selector, count)
+        drawn = all(text in t for t in found)
+        settled = (len(found) == count) and drawn and (found == last[0])
+        last[0] = found
+        return found if settled else False
+
+    return condition
+
+
+TimeoutException = common.exceptions.TimeoutException